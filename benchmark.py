@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from same_impl.bvh_parser import parse_bvh
+from same_impl.motion_database import MotionDatabase
+from same_impl.synthetic_bvh import generate_bvh
+
+
+def measure(name, function, items, unit, repeat, setup=None):
+    # timings are taken without tracemalloc (it slows Python code down); peak memory comes from one extra run
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start_time = time.perf_counter()
+        function(state)
+        times.append(time.perf_counter() - start_time)
+
+    state = setup() if setup is not None else None
+    tracemalloc.start()
+    function(state)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(times)
+    return {
+        'name': name,
+        'repeat': repeat,
+        'seconds_min': best,
+        'seconds_mean': sum(times) / len(times),
+        'items': items,
+        'unit': unit,
+        'throughput': items / best if best > 0 else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def create_headless_base():
+    from panda3d.core import loadPrcFileData
+    loadPrcFileData('', 'window-type none\naudio-library-name null\n'
+                        f'model-path {os.path.dirname(os.path.abspath(__file__))}')
+    from direct.showbase.ShowBase import ShowBase
+    return ShowBase()
+
+
+def run(args):
+    path = os.path.join(args.work_dir, 'synthetic.bvh')
+    generate_bvh(path, joints=args.joints, depth=args.depth, frames=args.frames,
+                 channel_orders=args.channel_orders, seed=args.seed)
+    skeleton, motion = parse_bvh(path)
+    joint_count = sum(1 for _ in skeleton.traverse_pre_order())
+    results = []
+
+    results.append(measure('parse_bvh', lambda _: parse_bvh(path), motion.frames, 'frames', args.repeat))
+
+    def load(_):
+        MotionDatabase().load_bvh(path, 'clip')
+    results.append(measure('MotionDatabase.load_bvh', load, motion.frames, 'frames', args.repeat))
+
+    def loaded_database():
+        database = MotionDatabase()
+        database.load_bvh(path, 'clip')
+        return database
+    results.append(measure('MotionDatabase.correct_skeleton_height',
+                           lambda database: database.correct_skeleton_height('clip'),
+                           motion.frames, 'frames', args.repeat, loaded_database))
+
+    results.append(measure('MotionDatabase.add_variation',
+                           lambda database: [database.add_variation('clip', seed=i) for i in range(args.variations)],
+                           args.variations, 'variations', args.repeat, loaded_database))
+
+    # per-joint, per-frame transforms (small NumPy matrices, each walking up to the root) are slow compared to
+    # whole-clip FK, so they only run on a prefix of the clip
+    sample = motion.data[:args.transform_frames]
+    joints = list(skeleton.traverse_pre_order())
+
+    def global_transforms(_):
+        for frame in sample:
+            for joint in joints:
+                joint.get_global_transform(frame)
+    results.append(measure('Joint.get_global_transform', global_transforms, len(sample) * joint_count,
+                           'joint-frames', args.repeat))
+
+    if not args.no_visualizer:
+        from same_impl.skeleton_visualizer import SkeletonVisualizer
+        base = create_headless_base()
+        visualizer = SkeletonVisualizer(base.render, base.loader, skeleton)
+
+        def update_joint(_):
+            for frame in sample:
+                visualizer.update_joint(frame)
+        results.append(measure('SkeletonVisualizer.update_joint', update_joint, len(sample), 'frames', args.repeat))
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'config': {
+            'joints_requested': args.joints,
+            'joints': joint_count,
+            'depth': args.depth,
+            'frames': motion.frames,
+            'channels': motion.data.shape[1],
+            'channel_orders': list(args.channel_orders),
+            'file_bytes': os.path.getsize(path),
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless benchmarks on a synthetic BVH clip')
+    parser.add_argument('--joints', type=int, default=31)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--channel-orders', nargs='+', default=['ZXY'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--variations', type=int, default=10)
+    parser.add_argument('--transform-frames', type=int, default=50)
+    parser.add_argument('--no-visualizer', action='store_true', help='skip benchmarks that need Panda3D')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        args.work_dir = work_dir
+        report = run(args)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,4 +1,6 @@
+import sys
+
 from same_impl.main_scene import MainScene
 
 if __name__ == '__main__':
-    MainScene().run()
\ No newline at end of file
+    MainScene(profile='--profile' in sys.argv[1:]).run()
\ No newline at end of file
@@ -0,0 +1,111 @@
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from same_impl.motion_database import MotionDatabase, load_bvh_worker, make_variations
+
+
+class BackgroundLoader:
+    # Loads clips and builds variations while the viewer keeps running. Parsing runs in worker processes
+    # (started with spawn, so the renderer is never forked); variations run on a background thread, where they
+    # share the source motion and the height basis cache with the viewer. poll() is called from a task on the
+    # main thread: it merges finished results into the database and calls the callbacks there, so they can
+    # create scene graph nodes directly.
+    def __init__(self, database: MotionDatabase, workers=None, on_clip=None, on_variation=None, on_error=None):
+        self.database = database
+        self.on_clip = on_clip
+        self.on_variation = on_variation
+        self.on_error = on_error
+        self.clip_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.variation_executor = ThreadPoolExecutor(max_workers=1)
+        # (future, kind, details) of submitted jobs
+        self.pending = []
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def load(self, path, name=None, variations=0, seed=None):
+        # variations of the clip are queued as soon as it is merged
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        future = self.clip_executor.submit(load_bvh_worker, path, self.database.cache_dir, self.database.storage)
+        self.pending.append((future, 'clip', (name, path, variations, seed)))
+        return name
+
+    def load_directory(self, directory, pattern='*.bvh', recursive=False, variations=0, seed=None):
+        if recursive:
+            paths = sorted(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+        else:
+            paths = sorted(glob.glob(os.path.join(directory, pattern)))
+        return [self.load(path, os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, '/'),
+                          variations, seed) for path in paths]
+
+    def add_variations(self, name, count, seed=None):
+        # one job per variation so they appear one by one; names are reserved now, so the name of each
+        # variation does not depend on the order in which jobs finish
+        skeleton = self.database.skeletons[name]
+        motion = self.database.motions.get(skeleton)
+        params = self.database.variation_params()
+        new_names = []
+        for seed_sequence in np.random.SeedSequence(seed).spawn(count):
+            new_name = self.database.find_variation_name(name)
+            future = self.variation_executor.submit(make_variations, skeleton, params, [seed_sequence], motion)
+            self.pending.append((future, 'variation', (new_name, name, motion)))
+            new_names.append(new_name)
+        return new_names
+
+    def poll(self, max_results=4):
+        # merges at most max_results finished jobs, so a burst of results does not stall one frame
+        merged = 0
+        for job in list(self.pending):
+            if merged >= max_results:
+                break
+            future, kind, details = job
+            if not future.done():
+                continue
+            self.pending.remove(job)
+            merged += 1
+            if kind == 'clip':
+                self.merge_clip(future, *details)
+            else:
+                self.merge_variation(future, *details)
+        return merged
+
+    def merge_clip(self, future, name, path, variations, seed):
+        try:
+            skeleton, motion, _, error = future.result()
+        except Exception as e:
+            skeleton, motion, error = None, None, f'{type(e).__name__}: {e}'
+        if error is not None:
+            self.report_error(name, error)
+            return
+        self.database.add_clip(name, skeleton, motion)
+        if self.on_clip is not None:
+            self.on_clip(name)
+        if variations:
+            self.add_variations(name, variations, seed)
+
+    def merge_variation(self, future, name, source_name, motion):
+        try:
+            skeleton = future.result()[0]
+        except Exception as e:
+            self.report_error(name, f'{type(e).__name__}: {e}')
+            return
+        self.database.add_shared_skeleton(name, skeleton, motion)
+        if self.on_variation is not None:
+            self.on_variation(name, source_name)
+
+    def report_error(self, name, error):
+        if self.on_error is not None:
+            self.on_error(name, error)
+        else:
+            print(f'Failed to load {name}: {error}')
+
+    def shutdown(self):
+        self.clip_executor.shutdown(wait=False, cancel_futures=True)
+        self.variation_executor.shutdown(wait=False, cancel_futures=True)
+        self.pending = []
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from same_impl.bvh_parser import parse_bvh
+from same_impl.motion_struct import Joint, Motion
+
+CACHE_VERSION = 2
+
+
+def hash_file(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def skeleton_to_dict(joint: Joint):
+    return {
+        'name': joint.name,
+        'type': joint.type,
+        'offset': [float(joint.offset[0]), float(joint.offset[1]), float(joint.offset[2])],
+        'channels': list(joint.channels),
+        'children': [skeleton_to_dict(child) for child in joint.children],
+    }
+
+
+def skeleton_from_dict(data) -> Joint:
+    return Joint(
+        name=data['name'],
+        type=data['type'],
+        channels=list(data['channels']),
+        offset=np.array(data['offset'], dtype=np.float64),
+        children=[skeleton_from_dict(child) for child in data['children']],
+    )
+
+
+class BVHCache:
+    # On-disk cache of parsed BVH clips. Each entry is a JSON header (source stat, content hash, hierarchy)
+    # next to a .npy file holding the motion data, so hits skip parsing and can be memory-mapped.
+    def __init__(self, cache_dir, mmap_mode='r', verify_hash=False, dtype=np.float64):
+        self.cache_dir = cache_dir
+        self.mmap_mode = mmap_mode
+        self.verify_hash = verify_hash
+        self.dtype = np.dtype(dtype)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_paths(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.npy'
+
+    def load(self, path) -> (Joint, Motion):
+        stat = os.stat(path)
+        header_path, data_path = self.entry_paths(path)
+        header = self.read_header(header_path)
+
+        if header is not None:
+            same_stat = header['size'] == stat.st_size and header['mtime_ns'] == stat.st_mtime_ns
+            if same_stat and not self.verify_hash:
+                entry = self.read_entry(header, data_path)
+                if entry is not None:
+                    return entry
+
+        # the stat changed (or hashing is forced): only re-parse if the content really changed
+        digest = hash_file(path)
+        if header is not None and header['hash'] == digest:
+            entry = self.read_entry(header, data_path)
+            if entry is not None:
+                header['size'] = stat.st_size
+                header['mtime_ns'] = stat.st_mtime_ns
+                self.write_header(header_path, header)
+                return entry
+
+        skeleton, motion = parse_bvh(path, dtype=self.dtype)
+        self.store(path, stat, digest, skeleton, motion)
+        return skeleton, motion
+
+    def read_header(self, header_path):
+        try:
+            with open(header_path) as file:
+                header = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if header.get('version') != CACHE_VERSION or header.get('dtype') != self.dtype.str:
+            return None
+        return header
+
+    def read_entry(self, header, data_path):
+        try:
+            data = np.load(data_path, mmap_mode=self.mmap_mode)
+        except (OSError, ValueError):
+            return None
+        skeleton = skeleton_from_dict(header['skeleton'])
+        total_channels = skeleton.cache_channel_index()
+        if data.shape != (header['frames'], total_channels):
+            return None
+        return skeleton, Motion(frames=header['frames'], frame_time=header['frame_time'], data=data)
+
+    def store(self, path, stat, digest, skeleton, motion):
+        header_path, data_path = self.entry_paths(path)
+        header = {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': digest,
+            'dtype': self.dtype.str,
+            'frames': motion.frames,
+            'frame_time': motion.frame_time,
+            'skeleton': skeleton_to_dict(skeleton),
+        }
+        # write the data first; the header is what makes an entry valid
+        temp_path = f'{data_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(motion.data, dtype=self.dtype))
+        os.replace(temp_path, data_path)
+        self.write_header(header_path, header)
+
+    @staticmethod
+    def write_header(header_path, header):
+        temp_path = f'{header_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(header, file)
+        os.replace(temp_path, header_path)
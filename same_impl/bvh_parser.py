@@ -1,10 +1,12 @@
+import re
+from functools import lru_cache
+
 import numpy as np
 from lark import Lark, Transformer
-from panda3d.core import Vec3
 
 from same_impl.motion_struct import Joint, Motion
 
-grammar = '''
+hierarchy_grammar = '''
 %import common.LETTER
 %import common.DIGIT
 %import common.SIGNED_NUMBER -> NUMBER
@@ -15,17 +17,25 @@ grammar = '''
 CHANNEL: "Xposition" | "Yposition" | "Zposition" | "Xrotation" | "Yrotation" | "Zrotation"
 NAME: ("_"|LETTER) ("_"|LETTER|DIGIT|":")*
 
-channels: "CHANNELS" INT (CHANNEL)+
+channels: "CHANNELS" INT (CHANNEL)*
 offset: "OFFSET" NUMBER NUMBER NUMBER
 
-start: "HIERARCHY" root "MOTION" motion
 root: "ROOT" NAME "{" offset channels (joint | end_joint)+ "}"
 joint: "JOINT" NAME "{" offset channels (joint | end_joint)+ "}"
 end_joint: "End" "Site" "{" offset "}"
+'''
+
+grammar = hierarchy_grammar + '''
+start: "HIERARCHY" root "MOTION" motion
 motion: "Frames:" INT "Frame Time:" NUMBER data
 data: (NUMBER)+
 '''
 
+# parses the HIERARCHY block only; the MOTION block is read directly into a numpy buffer
+hierarchy_start = '''
+start: "HIERARCHY" root
+'''
+
 
 class BVHParser(Transformer):
     def start(self, children):
@@ -59,7 +69,7 @@ class BVHParser(Transformer):
         )
 
     def offset(self, children):
-        return Vec3(children[0], children[1], children[2])
+        return np.array([children[0], children[1], children[2]])
 
     def channels(self, children):
         return children[1:]
@@ -83,11 +93,93 @@ class BVHParser(Transformer):
         return token.value
 
 
-def parse_bvh(file_path) -> (Joint, Motion):
+class HierarchyParser(BVHParser):
+    def start(self, children):
+        return children[0]
+
+
+@lru_cache(maxsize=None)
+def get_parser(hierarchy_only=False):
+    if hierarchy_only:
+        return Lark(hierarchy_grammar + hierarchy_start, parser='lalr', transformer=HierarchyParser())
+    return Lark(grammar, parser='lalr', transformer=BVHParser())
+
+
+def read_text_line(file):
+    # accepts files opened in text or binary mode
+    line = file.readline()
+    return line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+# MOTION as a whitespace-separated token, and the two header fields after it, which may share lines
+MOTION_KEYWORD = re.compile(r'(?<!\S)MOTION(?!\S)')
+MOTION_HEADER = re.compile(r'\s*Frames:\s*(\S+)\s+Frame\s+Time:\s*(\S+)')
+# tokens of a complete header, 'Frames:' N 'Frame' 'Time:' T
+MOTION_HEADER_TOKENS = 5
+
+
+def read_hierarchy(file) -> (Joint, str):
+    # returns the skeleton and the rest of the line after the MOTION keyword
+    lines = []
+    while True:
+        line = read_text_line(file)
+        if not line:
+            raise ValueError('Unexpected end of file: MOTION block not found')
+        match = MOTION_KEYWORD.search(line)
+        if match:
+            lines.append(line[:match.start()])
+            break
+        lines.append(line)
+    skeleton: Joint = get_parser(hierarchy_only=True).parse(''.join(lines))
+    skeleton.cache_channel_index()
+    return skeleton, line[match.end():]
+
+
+def read_motion_header(file, text=''):
+    # reads lines until the header is complete, skipping blank ones; returns the text after the frame time
+    while True:
+        match = MOTION_HEADER.match(text)
+        # the frame time is complete once something (at least the line break) follows it
+        if match and match.end() < len(text):
+            break
+        if not match and len(text.split()) >= MOTION_HEADER_TOKENS:
+            raise ValueError('Invalid MOTION header')
+        line = read_text_line(file)
+        if not line:
+            if match:
+                break
+            raise ValueError('Invalid MOTION header')
+        text += line
+    try:
+        return int(match[1]), float(match[2]), text[match.end():]
+    except ValueError:
+        raise ValueError('Invalid MOTION header')
+
+
+def read_motion_data(file, data, text='', chunk_size=1 << 22):
+    # fill the preallocated (frames, channels) buffer in chunks of whole lines, starting with `text`
+    flat = data.reshape(-1)
+    count = 0
+    lines = [text]
+    while lines:
+        tokens = ''.join(lines).split()
+        if count + len(tokens) > flat.size:
+            count += len(tokens)
+            break
+        flat[count:count + len(tokens)] = tokens
+        count += len(tokens)
+        lines = file.readlines(chunk_size)
+    return count
+
+
+def parse_bvh(file_path, fast=True, dtype=np.float64) -> (Joint, Motion):
+    if fast:
+        return parse_bvh_fast(file_path, dtype)
+
     # read and parse the bvh file
     with open(file_path) as file:
         bvh = file.read()
-    parser = Lark(grammar, parser='lalr', transformer=BVHParser())
+    parser = get_parser()
 
     skeleton: Joint
     motion: Motion
@@ -101,6 +193,107 @@ def parse_bvh(file_path) -> (Joint, Motion):
     assert total_channels * motion.frames == len(motion.data), \
         f"Total channels {total_channels} and frame {motion.frames} does not match motion data {len(motion.data)}"
 
-    motion.data = np.array(motion.data).reshape(motion.frames, total_channels)
+    motion.data = np.array(motion.data, dtype=dtype).reshape(motion.frames, total_channels)
 
     return skeleton, motion
+
+
+def parse_bvh_fast(file_path, dtype=np.float64) -> (Joint, Motion):
+    with open(file_path) as file:
+        skeleton, text = read_hierarchy(file)
+        frames, frame_time, text = read_motion_header(file, text)
+
+        total_channels = 0
+        for node in skeleton.traverse_pre_order():
+            total_channels += len(node.channels)
+        data = np.empty((frames, total_channels), dtype=dtype)
+        count = read_motion_data(file, data, text)
+
+    assert total_channels * frames == count, \
+        f"Total channels {total_channels} and frame {frames} does not match motion data {count}"
+
+    return skeleton, Motion(frames=frames, frame_time=frame_time, data=data)
+
+
+class BVHStream:
+    # Lazily reads the MOTION block of a BVH file with one frame per line. Only the hierarchy and header are
+    # parsed up front; frames are read on demand in bounded windows. Byte offsets of every
+    # `index_interval`-th frame are remembered while reading, so later seeks do not rescan the file.
+    def __init__(self, file_path, dtype=np.float64, index_interval=1024):
+        self.file = open(file_path, 'rb')
+        try:
+            self.skeleton, text = read_hierarchy(self.file)
+            self.frames, self.frame_time, text = read_motion_header(self.file, text)
+            if text.strip():
+                raise ValueError('BVHStream needs every frame on its own line')
+            self.skip_blank_lines()
+        except Exception:
+            self.file.close()
+            raise
+        self.channels = sum(len(node.channels) for node in self.skeleton.traverse_pre_order())
+        self.dtype = np.dtype(dtype)
+        self.index_interval = index_interval
+        self.checkpoints = [self.file.tell()]
+        self.position = 0
+
+    def skip_blank_lines(self):
+        # so the first checkpoint is the start of frame 0
+        while True:
+            position = self.file.tell()
+            line = self.file.readline()
+            if not line or line.strip():
+                self.file.seek(position)
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def seek(self, frame):
+        if not 0 <= frame <= self.frames:
+            raise IndexError(f'Frame {frame} out of range [0, {self.frames}]')
+        checkpoint = min(frame // self.index_interval, len(self.checkpoints) - 1)
+        # continue from the current position if that is closer than the last checkpoint
+        if not (checkpoint * self.index_interval <= self.position <= frame):
+            self.file.seek(self.checkpoints[checkpoint])
+            self.position = checkpoint * self.index_interval
+        while self.position < frame:
+            self.read_line()
+
+    def read_line(self):
+        line = self.file.readline()
+        if not line:
+            raise ValueError(f'Unexpected end of file at frame {self.position} of {self.frames}')
+        self.position += 1
+        if self.position % self.index_interval == 0 and self.position // self.index_interval == len(self.checkpoints):
+            self.checkpoints.append(self.file.tell())
+        return line
+
+    def read(self, start=0, stop=None):
+        stop = self.frames if stop is None else min(stop, self.frames)
+        self.seek(start)
+        data = np.empty((max(stop - start, 0), self.channels), dtype=self.dtype)
+        tokens = b''.join([self.read_line() for _ in range(len(data))]).split()
+        assert len(tokens) == data.size, \
+            f"Frames {start}-{stop} with {self.channels} channels do not match motion data {len(tokens)}"
+        data.reshape(-1)[:] = tokens
+        return data
+
+    def iter_windows(self, size, start=0, stop=None, step=None):
+        # yields (first frame, data) for consecutive windows of at most `size` frames
+        stop = self.frames if stop is None else min(stop, self.frames)
+        step = size if step is None else step
+        for window_start in range(start, stop, step):
+            yield window_start, self.read(window_start, min(window_start + size, stop))
+
+    def iter_frames(self, start=0, stop=None, window=1024):
+        for _, data in self.iter_windows(window, start, stop):
+            yield from data
+
+    def motion(self) -> Motion:
+        return Motion(frames=self.frames, frame_time=self.frame_time, data=self.read())
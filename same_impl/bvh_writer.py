@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from same_impl.motion_struct import Joint, Motion
+from same_impl.skeleton_plans import skeleton_plan
+
+
+def format_offset(offset):
+    # repr of a Python float is the shortest string that parses back to the same value
+    return ' '.join(repr(float(value)) for value in offset)
+
+
+def hierarchy_lines(joint: Joint, depth=0):
+    indent = '\t' * depth
+    if joint.type == 'end':
+        return [f'{indent}End Site', f'{indent}{{', f'{indent}\tOFFSET {format_offset(joint.offset)}', f'{indent}}}']
+
+    keyword = 'ROOT' if depth == 0 else 'JOINT'
+    lines = [f'{indent}{keyword} {joint.name}', f'{indent}{{', f'{indent}\tOFFSET {format_offset(joint.offset)}',
+             f'{indent}\tCHANNELS {len(joint.channels)}' + ''.join(f' {channel}' for channel in joint.channels)]
+    children = joint.children
+    if not children:
+        # the format needs at least one child per joint; this is the only case where re-parsing adds a joint
+        children = [Joint('end', 'end', joint)]
+    for child in children:
+        lines += hierarchy_lines(child, depth + 1)
+    lines.append(f'{indent}}}')
+    return lines
+
+
+def write_bvh(path, skeleton: Joint, motion: Motion, chunk_frames=4096):
+    # MOTION columns follow the skeleton's own pre-order channel layout, so skeletons sharing a bigger buffer
+    # (variations with removed joints) are written densely. Each chunk of frames is formatted by one
+    # %-operation over a whole-chunk template instead of per-float string building.
+    channel_map = skeleton_plan(skeleton).channel_map
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w') as file:
+        file.write('HIERARCHY\n')
+        file.write('\n'.join(hierarchy_lines(skeleton)))
+        file.write(f'\nMOTION\nFrames: {motion.frames}\nFrame Time: {float(motion.frame_time)!r}\n')
+        if len(channel_map) == 0:
+            file.write('\n' * motion.frames)
+            return path
+
+        row_template = ' '.join(['%r'] * len(channel_map)) + '\n'
+        for start in range(0, motion.frames, chunk_frames):
+            stop = min(start + chunk_frames, motion.frames)
+            chunk = np.asarray(motion.take(np.arange(start, stop)), dtype=np.float64)[:, channel_map]
+            file.write((row_template * (stop - start)) % tuple(chunk.ravel().tolist()))
+    return path
+
+
+def write_bvh_worker(paths, skeletons, motion):
+    return [write_bvh(path, skeleton, motion) for path, skeleton in zip(paths, skeletons)]
+
+
+def write_bvh_batch(items, workers=None, chunk_size=None):
+    # items: (path, skeleton, motion) triples. Items sharing a motion buffer (e.g. variations of one clip) are
+    # sent to workers in chunks together, so each chunk pickles the motion once.
+    items = list(items)
+    groups = {}
+    for path, skeleton, motion in items:
+        groups.setdefault(id(motion.buffer), (motion, []))[1].append((path, skeleton))
+
+    if workers == 1 or len(items) <= 1:
+        for motion, entries in groups.values():
+            write_bvh_worker([path for path, _ in entries], [skeleton for _, skeleton in entries], motion)
+        return [path for path, _, _ in items]
+
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or max(1, -(-len(items) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for motion, entries in groups.values():
+            for i in range(0, len(entries), chunk_size):
+                chunk = entries[i:i + chunk_size]
+                futures.append(executor.submit(write_bvh_worker, [path for path, _ in chunk],
+                                               [skeleton for _, skeleton in chunk], motion))
+        for future in futures:
+            future.result()
+    return [path for path, _, _ in items]
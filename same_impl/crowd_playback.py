@@ -0,0 +1,122 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from same_impl.motion_struct import Joint, Motion, SkeletonArrays
+from same_impl.skeleton_plans import fk_program
+from same_impl.skeleton_visualizer import InstancedSkeletonRenderer
+
+
+class Character:
+    __slots__ = ['arrays', 'motion', 'position', 'time_offset', 'rate']
+
+    def __init__(self, arrays, motion, position, time_offset, rate):
+        self.arrays = arrays
+        self.motion = motion
+        self.position = position
+        self.time_offset = time_offset
+        self.rate = rate
+
+
+class CrowdPlayback:
+    # Plays many skeletons at once. All characters are merged into one forest skeleton whose channel
+    # offsets point into a single gathered row of motion data, so each tick is one batched FK pass and
+    # one instanced draw update. Characters sharing a motion buffer (e.g. variations) are gathered together.
+    def __init__(self, render, loader, joint_radius=0.4, connection_radius=0.2, history=120):
+        self.renderer = InstancedSkeletonRenderer(render, loader, joint_radius, connection_radius)
+        self.characters = []
+        self.update_times = deque(maxlen=history)
+
+        self.program = None
+        self.groups = None
+        self.joint_characters = None
+
+    def add_character(self, skeleton: Joint, motion: Motion, position=(0, 0, 0), color=(1, 0, 0, 1),
+                      time_offset=0.0, rate=1.0):
+        arrays = SkeletonArrays.from_joint(skeleton)
+        self.renderer.add_skeleton(arrays, color, position)
+        self.characters.append(Character(arrays, motion, np.asarray(position, dtype=np.float64), time_offset, rate))
+        self.program = None
+        return len(self.characters) - 1
+
+    def compile(self):
+        groups = {}
+        for index, character in enumerate(self.characters):
+            groups.setdefault(id(character.motion.buffer), []).append(index)
+
+        # columns of the gathered row: one block of data columns per character, grouped by buffer
+        base_columns = np.zeros(len(self.characters), dtype=np.intp)
+        column = 0
+        self.groups = []
+        for indices in groups.values():
+            motion = self.characters[indices[0]].motion
+            for index in indices:
+                base_columns[index] = column
+                column += motion.buffer.shape[1]
+            self.groups.append((motion, np.array(indices, dtype=np.intp)))
+
+        names, types, parents, offsets, depths, layouts, counts, channel_offsets = [], [], [], [], [], [], [], []
+        joint_start = 0
+        for character, base_column in zip(self.characters, base_columns):
+            arrays = character.arrays
+            names.extend(arrays.names)
+            types.extend(arrays.types)
+            parents.append(np.where(arrays.parents >= 0, arrays.parents + joint_start, -1))
+            # the root offset is the outermost translation, so it also places the character
+            character_offsets = arrays.offsets.copy()
+            character_offsets[0] += character.position
+            offsets.append(character_offsets)
+            depths.append(arrays.depths)
+            layouts.append(arrays.channel_layout)
+            counts.append(arrays.channel_counts)
+            channel_offsets.append(np.where(arrays.channel_offsets >= 0, arrays.channel_offsets + base_column, -1))
+            joint_start += len(arrays)
+
+        forest = SkeletonArrays(names, types, np.concatenate(parents), np.concatenate(offsets),
+                                np.concatenate(depths), np.concatenate(layouts), np.concatenate(counts),
+                                np.concatenate(channel_offsets))
+        self.program = fk_program(forest)
+        self.joint_characters = np.repeat(np.arange(len(self.characters)),
+                                          [len(character.arrays) for character in self.characters])
+
+    def update(self, seconds):
+        if not self.characters:
+            return
+        start_time = time.perf_counter()
+        if self.program is None:
+            self.compile()
+
+        characters = self.characters
+        frame_times = np.array([character.motion.frame_time for character in characters])
+        frame_counts = np.array([character.motion.frames for character in characters])
+        rates = np.array([character.rate for character in characters])
+        time_offsets = np.array([character.time_offset for character in characters])
+
+        frames = (seconds * rates + time_offsets) / frame_times
+        base = np.floor(frames)
+        blend = frames - base
+        current = base.astype(np.intp) % frame_counts
+        following = (current + 1) % frame_counts
+
+        # only the frames in use are read, so quantized motions decode two rows per character
+        rows = np.concatenate([motion.take(np.stack([current[indices], following[indices]])).reshape(2, -1)
+                               for motion, indices in self.groups], axis=1)
+        _, positions = self.program.run(rows)
+        weights = blend[self.joint_characters][:, None]
+        self.renderer.update_flat(positions[0] * (1 - weights) + positions[1] * weights)
+
+        self.update_times.append(time.perf_counter() - start_time)
+
+    def show_rest_pose(self):
+        self.renderer.update()
+
+    def stats(self):
+        times = np.array(self.update_times) if self.update_times else np.zeros(1)
+        return {
+            'characters': len(self.characters),
+            'joints': int(sum(len(character.arrays) for character in self.characters)),
+            'last_update_ms': float(times[-1] * 1000),
+            'mean_update_ms': float(times.mean() * 1000),
+            'max_update_ms': float(times.max() * 1000),
+        }
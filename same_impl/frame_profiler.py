@@ -0,0 +1,162 @@
+import csv
+import json
+import time
+from collections import deque
+
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import TextNode
+
+
+class Section:
+    __slots__ = ['profiler', 'name', 'count', 'start_time']
+
+    def __init__(self, profiler, name, count):
+        self.profiler = profiler
+        self.name = name
+        self.count = count
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter() - self.start_time, self.count)
+        return False
+
+
+class NullSection:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SECTION = NullSection()
+
+
+class FrameProfiler:
+    # Per-frame timings of named sections (tasks, visualizer updates) for the last `history` frames.
+    # end_frame runs once per frame after rendering; a frame that took longer than 1.5 target frame times
+    # counts the target frames it missed as dropped. Disabled sections cost one attribute check.
+    def __init__(self, enabled=False, history=600, target_fps=60):
+        self.enabled = enabled
+        self.target_fps = target_fps
+        self.frames = deque(maxlen=history)
+        self.current = {}
+        self.counts = {}
+        self.frame_index = 0
+        self.dropped_frames = 0
+        self.start_time = time.perf_counter()
+        self.last_frame_time = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        # do not count the pause as one long frame
+        self.last_frame_time = None
+        self.current = {}
+
+    def section(self, name, count=None):
+        # count is the number of skeletons updated in the section, for per-skeleton costs
+        if not self.enabled:
+            return NULL_SECTION
+        return Section(self, name, count)
+
+    def add(self, name, seconds, count=None):
+        self.current[name] = self.current.get(name, 0.0) + seconds * 1000
+        if count is not None:
+            self.counts[name] = count
+
+    def wrap_task(self, function, name=None):
+        name = name or function.__name__
+
+        def task(task_object):
+            if not self.enabled:
+                return function(task_object)
+            with self.section(name):
+                return function(task_object)
+        return task
+
+    def end_frame(self):
+        now = time.perf_counter()
+        if self.enabled and self.last_frame_time is not None:
+            frame_ms = (now - self.last_frame_time) * 1000
+            dropped = max(0, round(frame_ms * self.target_fps / 1000) - 1) if \
+                frame_ms > 1500 / self.target_fps else 0
+            self.dropped_frames += dropped
+            self.frames.append({'frame': self.frame_index, 'time': now - self.start_time, 'frame_ms': frame_ms,
+                                'dropped': dropped, 'sections': self.current})
+        self.current = {}
+        self.frame_index += 1
+        self.last_frame_time = now if self.enabled else None
+
+    def summary(self):
+        frames = list(self.frames)
+        total_ms = sum(frame['frame_ms'] for frame in frames)
+        sections = {}
+        for frame in frames:
+            for name, ms in frame['sections'].items():
+                entry = sections.setdefault(name, {'mean_ms': 0.0, 'max_ms': 0.0})
+                entry['mean_ms'] += ms / len(frames)
+                entry['max_ms'] = max(entry['max_ms'], ms)
+        for name, entry in sections.items():
+            if self.counts.get(name):
+                entry['skeletons'] = self.counts[name]
+                entry['per_skeleton_ms'] = entry['mean_ms'] / self.counts[name]
+        return {
+            'frames': len(frames),
+            'fps': 1000 * len(frames) / total_ms if total_ms > 0 else 0.0,
+            'mean_frame_ms': total_ms / len(frames) if frames else 0.0,
+            'max_frame_ms': max((frame['frame_ms'] for frame in frames), default=0.0),
+            'dropped_frames': self.dropped_frames,
+            'sections': sections,
+        }
+
+    def dump(self, path):
+        # .csv: one row per frame with a column per section; anything else: JSON with the summary and all frames
+        frames = list(self.frames)
+        if path.endswith('.csv'):
+            names = sorted(set(name for frame in frames for name in frame['sections']))
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['frame', 'time', 'frame_ms', 'dropped'] + [f'{name}_ms' for name in names])
+                for frame in frames:
+                    writer.writerow([frame['frame'], frame['time'], frame['frame_ms'], frame['dropped']] +
+                                    [frame['sections'].get(name, 0.0) for name in names])
+        else:
+            with open(path, 'w') as file:
+                json.dump({'summary': self.summary(), 'frames': frames}, file, indent=1)
+        return path
+
+
+class ProfilerOverlay:
+    # on-screen summary of a FrameProfiler, refreshed a few times per second
+    def __init__(self, profiler: FrameProfiler, parent, interval=0.25):
+        self.profiler = profiler
+        self.interval = interval
+        self.last_update = 0.0
+        self.text = OnscreenText(text='', parent=parent, pos=(0.05, -0.08), scale=0.045, fg=(1, 1, 1, 1),
+                                 bg=(0, 0, 0, 0.5), align=TextNode.A_left, mayChange=True)
+        self.text.hide()
+
+    def update(self):
+        if not self.profiler.enabled:
+            self.text.hide()
+            return
+        now = time.perf_counter()
+        if now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        summary = self.profiler.summary()
+        lines = [f"{summary['fps']:.1f} fps  frame {summary['mean_frame_ms']:.2f} ms (max "
+                 f"{summary['max_frame_ms']:.2f})  dropped {summary['dropped_frames']}"]
+        for name, entry in sorted(summary['sections'].items()):
+            line = f"{name}: {entry['mean_ms']:.2f} ms (max {entry['max_ms']:.2f})"
+            if 'per_skeleton_ms' in entry:
+                line += f", {entry['skeletons']} skeletons, {entry['per_skeleton_ms']:.3f} ms each"
+            lines.append(line)
+        self.text.setText('\n'.join(lines))
+        self.text.show()
@@ -0,0 +1,128 @@
+import numpy as np
+from panda3d.core import GeomEnums, OmniBoundingVolume, Shader, Texture
+
+vertex_shader = '''
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform samplerBuffer instance_transforms;
+uniform samplerBuffer instance_colors;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+
+out vec3 normal;
+out vec4 color;
+
+void main() {
+    int base = gl_InstanceID * 4;
+    mat4 transform = mat4(texelFetch(instance_transforms, base),
+                          texelFetch(instance_transforms, base + 1),
+                          texelFetch(instance_transforms, base + 2),
+                          texelFetch(instance_transforms, base + 3));
+    gl_Position = p3d_ModelViewProjectionMatrix * transform * p3d_Vertex;
+    normal = normalize(p3d_NormalMatrix * (mat3(transform) * p3d_Normal));
+    color = texelFetch(instance_colors, gl_InstanceID);
+}
+'''
+
+fragment_shader = '''
+#version 150
+
+in vec3 normal;
+in vec4 color;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    float light = max(dot(normalize(normal), normalize(vec3(0.3, 0.5, 0.8))), 0.0);
+    p3d_FragColor = vec4(color.rgb * (0.35 + 0.65 * light), color.a);
+}
+'''
+
+
+def create_buffer(name, texels):
+    buffer = Texture(name)
+    buffer.setup_buffer_texture(max(texels, 1), Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+    return buffer
+
+
+class InstancedPrimitive:
+    # One model drawn many times with hardware instancing. Per-instance transforms (4x4, column-vector
+    # convention) and colors live in buffer textures, so the draw call count does not grow with instances.
+    shader = None
+
+    def __init__(self, parent, loader, model_path, capacity=1024):
+        if InstancedPrimitive.shader is None:
+            InstancedPrimitive.shader = Shader.make(Shader.SL_GLSL, vertex_shader, fragment_shader)
+
+        self.model = loader.load_model(model_path)
+        self.model.flatten_strong()
+        self.model.reparent_to(parent)
+        self.model.set_shader(InstancedPrimitive.shader, 10)
+        # instances are placed by the shader, so the model's own bounds are meaningless for culling
+        self.model.node().set_bounds(OmniBoundingVolume())
+        self.model.node().set_final(True)
+
+        self.capacity = 0
+        self.count = 0
+        self.reserve(capacity)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        self.capacity = max(capacity, self.capacity * 2)
+        self.transforms = create_buffer('instance_transforms', self.capacity * 4)
+        self.colors = create_buffer('instance_colors', self.capacity)
+        self.model.set_shader_input('instance_transforms', self.transforms)
+        self.model.set_shader_input('instance_colors', self.colors)
+
+    def set_instances(self, transforms, colors):
+        count = len(transforms)
+        self.reserve(count)
+        # transposing a column-vector matrix gives its columns as consecutive texels
+        transform_buffer = np.frombuffer(memoryview(self.transforms.modify_ram_image()), dtype=np.float32)
+        transform_buffer[:count * 16] = np.asarray(transforms, dtype=np.float32).transpose(0, 2, 1).reshape(-1)
+        color_buffer = np.frombuffer(memoryview(self.colors.modify_ram_image()), dtype=np.float32)
+        color_buffer[:count * 4] = np.broadcast_to(np.asarray(colors, dtype=np.float32), (count, 4)).reshape(-1)
+        self.count = count
+        self.model.set_instance_count(count)
+        if count == 0:
+            self.model.hide()
+        else:
+            self.model.show()
+
+    def remove(self):
+        self.model.remove_node()
+
+
+def sphere_transforms(positions, radius):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    transforms = np.zeros((len(positions), 4, 4))
+    transforms[:, [0, 1, 2], [0, 1, 2]] = radius
+    transforms[:, :3, 3] = positions
+    transforms[:, 3, 3] = 1
+    return transforms
+
+
+def segment_transforms(starts, ends, radius):
+    # maps the unit cylinder (z in [-1, 1], radius 1) onto each segment
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+    direction = ends - starts
+    length = np.linalg.norm(direction, axis=-1)
+    axis_z = direction / np.maximum(length, 1e-12)[:, None]
+    # any vector not parallel to the segment gives a perpendicular basis
+    helper = np.where(np.abs(axis_z[:, [0]]) < 0.9, [[1.0, 0, 0]], [[0, 1.0, 0]])
+    axis_x = np.cross(helper, axis_z)
+    axis_x /= np.linalg.norm(axis_x, axis=-1, keepdims=True)
+    axis_y = np.cross(axis_z, axis_x)
+
+    transforms = np.zeros((len(starts), 4, 4))
+    transforms[:, :3, 0] = axis_x * radius
+    transforms[:, :3, 1] = axis_y * radius
+    transforms[:, :3, 2] = axis_z * (length / 2)[:, None]
+    transforms[:, :3, 3] = (starts + ends) / 2
+    transforms[:, 3, 3] = 1
+    return transforms
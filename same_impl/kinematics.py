@@ -0,0 +1,211 @@
+import numpy as np
+
+from same_impl.motion_struct import Joint, SkeletonArrays
+
+
+# the two coordinate axes rotated into each other by a rotation about x, y or z
+AXIS_PLANES = ((1, 2), (2, 0), (0, 1))
+
+
+def axis_rotation(axis, angles):
+    # rotation matrices (column-vector convention) about the x/y/z axis for angles in degrees
+    radians = np.radians(angles)
+    cos = np.cos(radians)
+    sin = np.sin(radians)
+    matrices = np.zeros(radians.shape + (3, 3), dtype=radians.dtype)
+    i, j = AXIS_PLANES[axis]
+    matrices[..., axis, axis] = 1
+    matrices[..., i, i] = cos
+    matrices[..., i, j] = -sin
+    matrices[..., j, i] = sin
+    matrices[..., j, j] = cos
+    return matrices
+
+
+class FKProgram:
+    __slots__ = ['parents', 'offsets', 'channel_groups', 'levels']
+
+    def __init__(self, skeleton):
+        if isinstance(skeleton, Joint):
+            skeleton = SkeletonArrays.from_joint(skeleton)
+        self.parents = skeleton.parents
+        self.offsets = skeleton.offsets
+
+        # group joints by (channel slot, channel type) so each group is a single batched operation;
+        # joints whose rotation is still the identity at that slot are grouped apart and skip the product
+        self.channel_groups = []
+        rotated = np.zeros(len(self.parents), dtype=bool)
+        for slot in range(skeleton.channel_layout.shape[1]):
+            codes = skeleton.channel_layout[:, slot]
+            for channel in np.unique(codes[codes >= 0]):
+                selected = codes == channel
+                for identity in (True, False):
+                    joint_indices = np.flatnonzero(selected & (rotated != identity))
+                    if len(joint_indices) > 0:
+                        columns = skeleton.channel_offsets[joint_indices] + slot
+                        self.channel_groups.append((int(channel), joint_indices, columns, identity))
+            rotated |= codes >= 3
+
+        # joints of the same depth only depend on shallower ones, so each depth is one batched step
+        self.levels = skeleton.levels()[1:]
+
+    def with_offsets(self, offsets):
+        # the same program for a skeleton that only differs in its offsets
+        program = FKProgram.__new__(FKProgram)
+        program.parents = self.parents
+        program.offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 3)
+        program.channel_groups = self.channel_groups
+        program.levels = self.levels
+        return program
+
+    def local_transforms(self, data):
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        rotations, translations = self.joint_major_local(data)
+        return self.frame_major(rotations), self.frame_major(translations)
+
+    def run(self, data):
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        rotations, positions = self.joint_major_local(data)
+        self.joint_major_accumulate(rotations, positions)
+        return self.frame_major(rotations), self.frame_major(positions)
+
+    def global_rotations_local_translations(self, data):
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        rotations, translations = self.joint_major_local(data)
+        self.joint_major_accumulate(rotations, translations.copy())
+        return self.frame_major(rotations), self.frame_major(translations)
+
+    @staticmethod
+    def frame_major(array):
+        return np.ascontiguousarray(np.swapaxes(array, 0, 1))
+
+    # internally joints are the leading axis, so gathering a group of joints copies contiguous blocks
+
+    def joint_major_local(self, data):
+        frames = data.shape[0]
+        count = len(self.parents)
+        rotations = np.empty((count, frames, 3, 3), dtype=np.float64)
+        rotations[:] = np.eye(3)
+        translations = np.empty((count, frames, 3), dtype=np.float64)
+        translations[:] = self.offsets[:, None]
+
+        # channels are applied in order: M = T(offset) * C_1 * C_2 * ... * C_n
+        for channel, joint_indices, columns, identity in self.channel_groups:
+            values = data[:, columns].T
+            if channel < 3 and identity:
+                translations[joint_indices, :, channel] += values
+            elif channel < 3:
+                translations[joint_indices] += rotations[joint_indices][..., channel] * values[..., None]
+            elif identity:
+                rotations[joint_indices] = axis_rotation(channel - 3, values)
+            else:
+                # R @ axis_rotation only mixes the two columns orthogonal to the axis
+                i, j = AXIS_PLANES[channel - 3]
+                radians = np.radians(values)[..., None]
+                cos, sin = np.cos(radians), np.sin(radians)
+                block = rotations[joint_indices]
+                column_i = block[..., :, i].copy()
+                column_j = block[..., :, j].copy()
+                block[..., :, i] = column_i * cos + column_j * sin
+                block[..., :, j] = column_j * cos - column_i * sin
+                rotations[joint_indices] = block
+
+        return rotations, translations
+
+    def joint_major_accumulate(self, rotations, positions):
+        # turns local transforms into global ones in place, one depth level at a time
+        for joint_indices in self.levels:
+            parents = self.parents[joint_indices]
+            parent_rotations = rotations[parents]
+            positions[joint_indices] = (parent_rotations @ positions[joint_indices][..., None])[..., 0] + \
+                positions[parents]
+            rotations[joint_indices] = parent_rotations @ rotations[joint_indices]
+
+
+def forward_kinematics(skeleton, data):
+    # global rotations (frames x joints x 3 x 3) and positions (frames x joints x 3) in pre-order
+    return FKProgram(skeleton).run(data)
+
+
+def global_positions(skeleton, data):
+    return forward_kinematics(skeleton, data)[1]
+
+
+def local_transforms(skeleton, data):
+    # local rotations (frames x joints x 3 x 3) and translations (frames x joints x 3), offsets included
+    return FKProgram(skeleton).local_transforms(np.atleast_2d(np.asarray(data, dtype=np.float64)))
+
+
+def rotation_to_quaternion(matrices):
+    # (w, x, y, z) quaternions of rotation matrices, picking the numerically stable branch per matrix
+    m = np.asarray(matrices, dtype=np.float64)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+    candidates = np.stack([
+        np.stack([1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+        np.stack([m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20], axis=-1),
+        np.stack([m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], axis=-1),
+        np.stack([m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22], axis=-1),
+    ], axis=-2)
+    # each candidate is the quaternion scaled by 4 * its own component; use the largest one
+    choice = np.argmax(np.stack([m00 + m11 + m22, m00, m11, m22], axis=-1), axis=-1)
+    quaternions = np.take_along_axis(candidates, choice[..., None, None], axis=-2)[..., 0, :]
+    quaternions /= np.linalg.norm(quaternions, axis=-1, keepdims=True)
+    return quaternions
+
+
+def quaternion_to_rotation(quaternions):
+    w, x, y, z = np.moveaxis(np.asarray(quaternions, dtype=np.float64), -1, 0)
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=-1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=-1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=-2)
+
+
+def rotation_to_euler(matrices, axes):
+    # angles in degrees with R = R_axes[0] @ R_axes[1] @ R_axes[2] for three distinct axes (0, 1, 2 for x, y, z)
+    m = np.asarray(matrices, dtype=np.float64)
+    i, j, k = axes
+    sign = 1.0 if (j - i) % 3 == 1 else -1.0
+    middle = np.arcsin(np.clip(sign * m[..., i, k], -1, 1))
+    first = np.arctan2(-sign * m[..., j, k], m[..., k, k])
+    last = np.arctan2(-sign * m[..., i, j], m[..., i, i])
+    # in gimbal lock only first + last (or first - last) is defined, so put it all into the first angle
+    locked = np.abs(sign * m[..., i, k]) > 1 - 1e-9
+    first = np.where(locked, np.arctan2(sign * m[..., k, j], m[..., j, j]), first)
+    last = np.where(locked, 0, last)
+    return np.degrees(np.stack([first, middle, last], axis=-1))
+
+
+def make_continuous(quaternions, axis=0):
+    # flip signs along the time axis so neighbouring quaternions lie in the same hemisphere
+    quaternions = np.moveaxis(np.array(quaternions, dtype=np.float64), axis, 0)
+    dots = np.sum(quaternions[1:] * quaternions[:-1], axis=-1)
+    signs = np.cumprod(np.where(dots < 0, -1.0, 1.0), axis=0)
+    quaternions[1:] *= signs[..., None]
+    return np.moveaxis(quaternions, 0, axis)
+
+
+def nlerp(q0, q1, t):
+    t = np.asarray(t, dtype=np.float64)[..., None]
+    q1 = np.where(np.sum(q0 * q1, axis=-1, keepdims=True) < 0, -q1, q1)
+    quaternions = q0 * (1 - t) + q1 * t
+    return quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True)
+
+
+def slerp(q0, q1, t):
+    t = np.asarray(t, dtype=np.float64)[..., None]
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.clip(np.abs(dot), 0, 1)
+    angle = np.arccos(dot)
+    sin = np.sin(angle)
+    # fall back to normalized lerp where the quaternions are almost identical
+    close = sin < 1e-6
+    safe_sin = np.where(close, 1, sin)
+    w0 = np.where(close, 1 - t, np.sin((1 - t) * angle) / safe_sin)
+    w1 = np.where(close, t, np.sin(t * angle) / safe_sin)
+    quaternions = q0 * w0 + q1 * w1
+    return quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True)
@@ -3,15 +3,23 @@ import time
 import simplepbr
 from direct.showbase.ShowBase import ShowBase
 
+from same_impl.background_loader import BackgroundLoader
+from same_impl.crowd_playback import CrowdPlayback
+from same_impl.frame_profiler import FrameProfiler, ProfilerOverlay
 from same_impl.motion_database import MotionDatabase
 from same_impl.orbit_control import OrbitControl
+from same_impl.skeleton_plans import plan_cache
 from same_impl.skeleton_visualizer import SkeletonVisualizer
 
 
 class MainScene(ShowBase):
-    def __init__(self):
+    def __init__(self, profile=False):
         ShowBase.__init__(self)
 
+        # per-task and per-update timings; press p to toggle, o to write the trace
+        self.profiler = FrameProfiler(enabled=profile)
+        self.profiler_overlay = ProfilerOverlay(self.profiler, self.a2dTopLeft)
+
         simplepbr.init()
 
         self.floor = self.loader.load_model('models/grid_floor.glb')
@@ -42,48 +50,93 @@ class MainScene(ShowBase):
 
         # Add Orbit Control
         self.disable_mouse()
-        self.orbit_control = OrbitControl(self.mouseWatcherNode, self.camera, self.win)
-
-        # load motions
-        self.motion_database = MotionDatabase()
-        self.motion_database.load_bvh('data/LocomotionFlat01_000.bvh', 'LocomotionFlat01_000')
+        self.orbit_control = OrbitControl(self.mouseWatcherNode, self.camera, self.win, self.profiler)
 
-        # show skeleton
-        skeleton = self.motion_database.get_skeleton('LocomotionFlat01_000')
-        motion = self.motion_database.get_motion('LocomotionFlat01_000')
-        self.motion = motion
-        self.skeleton_visualizer = SkeletonVisualizer(self.render, self.loader, skeleton)
+        # variations are animated together in one batched FK pass and drawn with hardware instancing
+        self.crowd = CrowdPlayback(self.render, self.loader)
+        self.skeleton_visualizer = None
+        self.motion = None
         self.current_frame = 0
-        self.skeleton_visualizer.update_joint(motion.data[0])
 
-        for i in range(10):
-            variation_name = self.motion_database.add_variation('LocomotionFlat01_000')
-            new_skeleton = self.motion_database.get_skeleton(variation_name)
-            new_skeleton_visualizer = SkeletonVisualizer(self.render, self.loader, new_skeleton)
-            new_skeleton_visualizer.skeleton_np.set_pos(new_skeleton_visualizer.skeleton_np, 0, 0, -10 * i)
+        # clips are parsed and varied in the background; skeletons appear as their results are merged
+        self.motion_database = MotionDatabase(cache_dir='data/cache')
+        self.background_loader = BackgroundLoader(self.motion_database, on_clip=self.show_clip,
+                                                  on_variation=self.show_variation)
+        self.background_loader.load('data/LocomotionFlat01_000.bvh', 'LocomotionFlat01_000', variations=10)
 
         self.start_time = time.time()
-        self.taskMgr.add(self.update_frame, 'update_frame')
+        self.taskMgr.add(self.profiler.wrap_task(self.poll_loading), 'poll_loading')
+        self.taskMgr.add(self.profiler.wrap_task(self.update_frame), 'update_frame')
+        # after igLoop (sort 50), so a profiled frame includes rendering
+        self.taskMgr.add(self.end_profiler_frame, 'end_profiler_frame', sort=60)
 
         self.accept('escape', self.userExit)
 
         # press q to toggle animation
         self.accept('q', self.toggle_animation)
 
+        # press c to print crowd playback timings
+        self.accept('c', self.print_crowd_stats)
+
+        self.accept('p', self.profiler.toggle)
+        self.accept('o', self.dump_profile)
+
     def userExit(self):
+        self.background_loader.shutdown()
         self.destroy()
 
+    def poll_loading(self, task):
+        self.background_loader.poll()
+        return task.cont
+
+    def show_clip(self, name):
+        # the first clip is shown with its own visualizer, later ones join the crowd
+        skeleton = self.motion_database.get_skeleton(name)
+        motion = self.motion_database.get_motion(name)
+        if self.skeleton_visualizer is None:
+            self.motion = motion
+            self.skeleton_visualizer = SkeletonVisualizer(self.render, self.loader, skeleton)
+            self.skeleton_visualizer.set_motion(motion)
+            self.skeleton_visualizer.update_pose(0)
+        else:
+            self.show_variation(name, None)
+
+    def show_variation(self, name, source_name):
+        index = len(self.crowd.characters)
+        self.crowd.add_character(self.motion_database.get_skeleton(name), self.motion_database.get_motion(name),
+                                 position=(0, 0, -10 * index))
+
     show_anim = True
 
     def update_frame(self, task):
         current_time = time.time()
         if self.show_anim:
-            self.current_frame = int((current_time - self.start_time) / self.motion.frame_time) % \
-                                 self.motion.frames
-            self.skeleton_visualizer.update_joint(self.motion.data[self.current_frame])
+            elapsed = current_time - self.start_time
+            if self.skeleton_visualizer is not None:
+                self.current_frame = int(elapsed / self.motion.frame_time) % self.motion.frames
+                with self.profiler.section('skeleton_visualizer', 1):
+                    self.skeleton_visualizer.update_time(elapsed)
+            with self.profiler.section('crowd', len(self.crowd.characters)):
+                self.crowd.update(elapsed)
         else:
-            self.skeleton_visualizer.clear_joint_transform()
+            if self.skeleton_visualizer is not None:
+                self.skeleton_visualizer.clear_joint_transform()
+            self.crowd.show_rest_pose()
+        return task.cont
+
+    def end_profiler_frame(self, task):
+        self.profiler.end_frame()
+        self.profiler_overlay.update()
         return task.cont
 
+    def dump_profile(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        for extension in ('json', 'csv'):
+            print('profile written to', self.profiler.dump(f'profile-{stamp}.{extension}'))
+
     def toggle_animation(self):
         self.show_anim = not self.show_anim
+
+    def print_crowd_stats(self):
+        print(self.crowd.stats())
+        print(plan_cache.stats())
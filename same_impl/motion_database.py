@@ -1,18 +1,315 @@
 import copy
-import random
+import glob
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from math import floor
-from typing import Dict
+from typing import Dict, List
 
-from panda3d.core import Vec3
+import numpy as np
 
+from same_impl.bvh_cache import BVHCache
 from same_impl.bvh_parser import parse_bvh
-from same_impl.motion_struct import Joint, Motion
+from same_impl.bvh_writer import write_bvh_batch
+from same_impl.motion_quantization import QuantizedMotion, quantize_motion
+from same_impl.motion_struct import Joint, Motion, SkeletonArrays
+from same_impl.pose_index import PoseIndex
+from same_impl.resampling import resample_motion
+from same_impl.skeleton_plans import fk_program, skeleton_plan
+
+
+class HeightBasis:
+    # Joint heights of a motion as a linear function of the skeleton offsets. A joint's global height is the
+    # sum over its ancestors (and itself) of the parent's global y-axis row dotted with the local translation,
+    # and rotations do not depend on offsets. Skeletons with the same topology can therefore reuse `rows`
+    # (frames x joints x 3) and `bias` (the offset-independent part from position channels). They are kept in
+    # float32, so a basis only narrows down the frames that can hold the minimum; FK on those frames gives the
+    # exact value, the same bits as FK over the whole clip.
+    __slots__ = ['rows', 'bias', 'ancestors', 'bias_bound']
+
+    def __init__(self, arrays: SkeletonArrays, data, chunk_size=8192):
+        program = fk_program(arrays)
+        data = np.atleast_2d(data)
+        self.rows = np.empty((len(data), len(arrays), 3), dtype=np.float32)
+        self.bias = np.empty((len(data), len(arrays)), dtype=np.float32)
+        for start in range(0, len(data), chunk_size):
+            stop = min(start + chunk_size, len(data))
+            rotations, translations = program.global_rotations_local_translations(data[start:stop])
+            rows = self.rows[start:stop]
+            rows[:, 0] = (0, 1, 0)
+            rows[:, 1:] = rotations[:, arrays.parents[1:], 1, :]
+            self.bias[start:stop] = np.einsum('fja,fja->fj', rows, translations - arrays.offsets)
+
+        self.ancestors = np.eye(len(arrays), dtype=np.float32)
+        for joint_indices in skeleton_plan(arrays).levels[1:]:
+            self.ancestors[joint_indices] += self.ancestors[arrays.parents[joint_indices]]
+        # bounds the sum of a joint's bias terms over its ancestors
+        self.bias_bound = float(np.abs(self.bias).max(initial=0.0)) * len(arrays)
+
+    @staticmethod
+    def estimate_nbytes(frames, joints):
+        return 4 * frames * joints * 4
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.bias.nbytes + self.ancestors.nbytes
+
+    def heights(self, offsets):
+        offsets = np.asarray(offsets, dtype=np.float32)
+        return (np.einsum('fja,ja->fj', self.rows, offsets) + self.bias) @ self.ancestors.T
+
+    def candidate_frames(self, offsets):
+        # frames whose approximate lowest joint is within the float32 rounding error of the approximate minimum
+        frame_minima = self.heights(offsets).min(axis=1)
+        tolerance = 64 * np.finfo(np.float32).eps * (np.abs(offsets).sum() + self.bias_bound)
+        return np.flatnonzero(frame_minima <= frame_minima.min() + 2 * tolerance)
+
+
+def min_height(arrays: SkeletonArrays, motion: Motion, frames=None, chunk_size=8192):
+    # lowest joint height over the given frames (default: all), with FK run in chunks so memory stays bounded
+    # on long clips; quantized motions only decode one chunk at a time
+    frames = np.arange(motion.frames) if frames is None else frames
+    return stream_min_height(arrays, (motion.take(frames[start:start + chunk_size])
+                                      for start in range(0, len(frames), chunk_size)))
+
+
+class HeightBasisCache:
+    # Minimum joint heights of (topology, motion buffer) pairs. Most variations get a topology of their own, so the
+    # first lookup of a pair only runs FK; a basis is built when the pair comes back, and bases are evicted
+    # least recently used first to stay under max_bytes. The lock only guards the entries (variations can be
+    # built on a background thread); FK and bases run unlocked.
+    __slots__ = ['entries', 'max_bytes', 'max_entries', 'nbytes', 'lock']
+
+    def __init__(self, max_bytes=128 << 20, max_entries=1024):
+        # entries: key -> (weak reference to the buffer, basis or None when the pair was only seen once)
+        self.entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def min_height(self, arrays: SkeletonArrays, motion: Motion, offsets):
+        # keyed on the stored buffer, as QuantizedMotion.data decodes a new array on every access
+        buffer = motion.buffer
+        key = (arrays.topology_hash, id(buffer))
+        with self.lock:
+            entry = self.entries.get(key)
+            # the weak reference guards against a new array reusing the id of a collected one
+            seen = entry is not None and entry[0]() is buffer
+            if seen:
+                self.entries.move_to_end(key)
+            else:
+                self.store(key, buffer, None)
+        if seen and entry[1] is not None:
+            return min_height(arrays.with_offsets(offsets), motion, entry[1].candidate_frames(offsets))
+
+        if not seen or HeightBasis.estimate_nbytes(motion.frames, len(arrays)) > self.max_bytes:
+            return min_height(arrays.with_offsets(offsets), motion)
+        # the only full decode of the buffer for this key
+        basis = HeightBasis(arrays, motion.data)
+        with self.lock:
+            self.store(key, buffer, basis)
+        return min_height(arrays.with_offsets(offsets), motion, basis.candidate_frames(offsets))
+
+    def store(self, key, buffer, basis):
+        # callers hold the lock
+        self.remove([key] + [key for key, entry in self.entries.items() if entry[0]() is None])
+        self.entries[key] = (weakref.ref(buffer), basis)
+        self.nbytes += basis.nbytes if basis is not None else 0
+        while self.entries and (self.nbytes > self.max_bytes or len(self.entries) > self.max_entries):
+            self.remove([next(iter(self.entries))])
+
+    def remove(self, keys):
+        for key in keys:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[1] is not None:
+                self.nbytes -= entry[1].nbytes
+
+    def invalidate(self, buffer):
+        with self.lock:
+            self.remove([key for key in self.entries if key[1] == id(buffer)])
+
+
+height_basis_cache = HeightBasisCache()
+
+
+def correct_height(skeleton: Joint, motion: Motion = None, in_place=True):
+    arrays = SkeletonArrays.from_joint(skeleton)
+
+    # Adjust height of the skeleton to the ground
+    min_y = arrays.rest_global_positions()[:, 1].min()
+    skeleton.offset = skeleton.offset - (0, min_y, 0)
+
+    if motion is None:
+        return
+
+    offsets = arrays.offsets.copy()
+    offsets[0, 1] -= min_y
+    # Adjust height of the motion to the ground
+    if in_place:
+        min_y_motion = min_height(arrays.with_offsets(offsets), motion)
+    else:
+        min_y_motion = height_basis_cache.min_height(arrays, motion, offsets)
+
+    if not in_place or 'Yposition' not in skeleton.channels or isinstance(motion, QuantizedMotion):
+        # the motion data is shared with other skeletons: the root offset is applied outermost,
+        # so shifting it moves the whole motion without touching the shared buffer
+        skeleton.offset = skeleton.offset - (0, min_y_motion, 0)
+        return
+
+    channel_index = skeleton.channel_index + skeleton.channels.index('Yposition')
+    motion.data[:, channel_index] -= min_y_motion
+    height_basis_cache.invalidate(motion.buffer)
+
+
+def stream_min_height(skeleton: Joint, windows):
+    # minimum joint height over an iterable of motion data windows (e.g. BVHStream.iter_windows),
+    # so long clips can be ground-corrected in bounded memory
+    program = fk_program(skeleton)
+    min_y = float('inf')
+    for window in windows:
+        if isinstance(window, tuple):
+            window = window[1]
+        if len(window) > 0:
+            min_y = min(min_y, program.run(window)[1][..., 1].min())
+    return min_y
+
+
+def read_bvh(path, cache_dir=None, storage=None):
+    # storage is None (float64) or one of STORAGE_MODES; quantizing after the height correction keeps it exact
+    if cache_dir is not None:
+        skeleton, motion = BVHCache(cache_dir, mmap_mode='c').load(path)
+    else:
+        skeleton, motion = parse_bvh(path)
+    correct_height(skeleton, motion)
+    if storage is not None:
+        motion = quantize_motion(motion, storage)
+    return skeleton, motion
+
+
+def shared_motion(motion):
+    # a new Motion over the same buffer; quantized motions are never edited in place, so they are shared as is
+    if isinstance(motion, QuantizedMotion):
+        return motion
+    return Motion(motion.frames, motion.frame_time, motion.data)
+
+
+def load_bvh_worker(path, cache_dir=None, storage=None):
+    # runs in a worker process; errors are reported instead of raised so one bad file does not stop a batch
+    start_time = time.perf_counter()
+    try:
+        skeleton, motion = read_bvh(path, cache_dir, storage)
+        return skeleton, motion, time.perf_counter() - start_time, None
+    except Exception as e:
+        return None, None, time.perf_counter() - start_time, f'{type(e).__name__}: {e}'
+
+
+VARIATION_PARAMS = ('spine_add_prob', 'spine_remove_prob', 'neck_add_prob', 'neck_remove_prob', 'hip_add_prob',
+                    'shoulder_add_prob', 'end_zero_prob', 'scale_sigma')
+
+
+def traverse_skeleton_with_depth(skeleton, depth=0):
+    if 'augmented' not in skeleton.name.lower():
+        yield skeleton, depth
+    for child in skeleton.children:
+        if 'augmented' in child.name.lower():
+            yield from traverse_skeleton_with_depth(child, depth)
+        else:
+            yield from traverse_skeleton_with_depth(child, depth + 1)
+
+
+def depth_generator(seed_sequence, depth):
+    # joints at the same depth draw from the same stream, to make the result symmetric
+    return np.random.default_rng(np.random.SeedSequence(seed_sequence.entropy,
+                                                        spawn_key=seed_sequence.spawn_key + (depth,)))
+
+
+def make_variation(skeleton: Joint, params, seed_sequence, motion: Motion = None) -> Joint:
+    new_skeleton = copy.deepcopy(skeleton)
+    for joint, depth in traverse_skeleton_with_depth(new_skeleton):
+        rng = depth_generator(seed_sequence, depth)
+        rand = rng.random()
+        name = joint.name.lower()
+        # if joint is spine or neck, randomly add or remove joints
+        if 'spine' in name or 'neck' in name:
+            add_prob = params['spine_add_prob'] if 'spine' in name else params['neck_add_prob']
+            remove_prob = params['spine_remove_prob'] if 'spine' in name else params['neck_remove_prob']
+            if rand < add_prob:
+                # add joint to center of children
+                offset = sum([child.offset for child in joint.children], np.zeros(3)) / len(joint.children)
+                new_joint = Joint(name + '_augmented', joint.type, joint.parent, copy.copy(joint.children), [], offset)
+                new_joint.channel_index = joint.channel_index
+                joint.clear_children()
+                joint.add_child(new_joint)
+            elif rand < add_prob + remove_prob:
+                parent = joint.parent
+                parent.remove_child(joint)
+                children = copy.copy(joint.children)
+                for child in children:
+                    parent.add_child(child)
+        # if joint is hip or shoulder, randomly add dummy joints (end-joints)
+        elif 'hip' in name or 'shoulder' in name:
+            add_prob = params['hip_add_prob'] if 'hip' in name else params['shoulder_add_prob']
+            if rand < add_prob:
+                new_joint = Joint(name + '_augmented', 'end', joint, [], [])
+                # set offset as random value
+                new_joint.offset = rng.normal(0, 1, size=3)
+                joint.add_child(new_joint)
+        # if joint is end type, randomly set offset to zero
+        elif joint.type == 'end':
+            if rand < params['end_zero_prob']:
+                joint.offset = np.zeros(3)
+        # randomly scale offset
+        joint.offset = joint.offset * float(rng.normal(1, params['scale_sigma']))
+
+    correct_height(new_skeleton, motion, in_place=False)
+    return new_skeleton
+
+
+# motion shared by all variations made in a worker process, sent once through the pool initializer
+worker_motion = None
+
+
+def init_variation_worker(motion):
+    global worker_motion
+    worker_motion = motion
+
+
+def make_variations(skeleton: Joint, params, seed_sequences, motion: Motion = None) -> List[Joint]:
+    motion = motion if motion is not None else worker_motion
+    return [make_variation(skeleton, params, seed_sequence, motion) for seed_sequence in seed_sequences]
+
+
+class LoadReport:
+    __slots__ = ['name', 'path', 'seconds', 'error']
+
+    def __init__(self, name, path, seconds, error=None):
+        self.name = name
+        self.path = path
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else self.error
+        return f'LoadReport({self.name!r}, {self.seconds:.3f}s, {status})'
 
 
 class MotionDatabase:
-    def __init__(self):
+    def __init__(self, cache_dir=None, storage=None):
         self.skeletons: Dict[str, Joint] = {}
         self.motions: Dict[Joint, Motion] = {}
+        # cached motion data is memory-mapped copy-on-write, since height correction edits it in place
+        self.cache_dir = cache_dir
+        # None keeps float64 data; 'float32', 'int16' or 'delta' store loaded clips as QuantizedMotion
+        self.storage = storage
+        self.variation_counters: Dict[str, int] = {}
 
         self.spine_add_prob = 0.2
         self.spine_remove_prob = 0.2
@@ -23,11 +320,79 @@ class MotionDatabase:
         self.end_zero_prob = 0.3
         self.scale_sigma = 0.3
 
+        # built on demand by build_pose_index; clips loaded afterwards are added to it
+        self.pose_index = None
+
     def load_bvh(self, path, name):
-        skeleton, motion = parse_bvh(path)
+        skeleton, motion = read_bvh(path, self.cache_dir, self.storage)
+        self.add_clip(name, skeleton, motion)
+
+    def add_clip(self, name, skeleton, motion):
         self.skeletons[name] = skeleton
         self.motions[skeleton] = motion
-        self.correct_skeleton_height(name)
+        self.index_clip(name)
+
+    def load_many(self, paths, names=None, workers=None) -> List[LoadReport]:
+        paths = list(paths)
+        if names is None:
+            names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+        if workers == 1 or len(paths) <= 1:
+            results = [load_bvh_worker(path, self.cache_dir, self.storage) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(load_bvh_worker, path, self.cache_dir, self.storage) for path in paths]
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append((None, None, 0.0, f'{type(e).__name__}: {e}'))
+
+        # merge in input order so the database does not depend on worker completion order
+        reports = []
+        for path, name, (skeleton, motion, seconds, error) in zip(paths, names, results):
+            if error is None:
+                self.add_clip(name, skeleton, motion)
+            reports.append(LoadReport(name, path, seconds, error))
+        return reports
+
+    def load_directory(self, directory, pattern='*.bvh', recursive=False, workers=None) -> List[LoadReport]:
+        if recursive:
+            paths = sorted(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+        else:
+            paths = sorted(glob.glob(os.path.join(directory, pattern)))
+        names = [os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, '/') for path in paths]
+        return self.load_many(paths, names, workers)
+
+    def build_pose_index(self, names=None, **kwargs) -> PoseIndex:
+        # indexes the given clips (default: clip_names()); keyword arguments are PoseIndex options
+        self.pose_index = PoseIndex(**kwargs)
+        for name in (names if names is not None else self.clip_names()):
+            self.index_clip(name)
+        return self.pose_index
+
+    def load_pose_index(self, path, mmap_mode=None):
+        self.pose_index = PoseIndex.load(path, mmap_mode)
+        return self.pose_index
+
+    def index_clip(self, name):
+        if self.pose_index is None or name in self.pose_index.clip_names:
+            return
+        skeleton = self.skeletons[name]
+        # clips without the indexed joints (other skeleton layouts) are left out
+        if skeleton in self.motions and self.pose_index.accepts(skeleton):
+            self.pose_index.add_clip(name, skeleton, self.motions[skeleton])
+
+    def clip_names(self):
+        # one name per motion buffer, so variations sharing their source's data are left out
+        names, buffers = [], set()
+        for name, skeleton in self.skeletons.items():
+            motion = self.motions.get(skeleton)
+            if motion is not None and id(motion.buffer) not in buffers:
+                buffers.add(id(motion.buffer))
+                names.append(name)
+        return names
 
     def get_skeleton(self, name):
         return self.skeletons[name]
@@ -35,89 +400,120 @@ class MotionDatabase:
     def get_motion(self, name):
         return self.motions[self.skeletons[name]]
 
-    def correct_skeleton_height(self, name):
+    def correct_skeleton_height(self, name, in_place=True):
         skeleton = self.skeletons[name]
+        motion = self.motions.get(skeleton)
+        # editing a buffer other skeletons share would move them too, so the shift goes into the root offset
+        if in_place and motion is not None and self.shares_buffer(skeleton):
+            in_place = False
+        correct_height(skeleton, motion, in_place)
+
+    def shares_buffer(self, skeleton):
+        buffer = self.motions[skeleton].buffer
+        return any(other is not skeleton and motion.buffer is buffer for other, motion in self.motions.items())
+
+    def get_dense_motion(self, name):
+        # motion whose columns follow the skeleton's own pre-order channel layout; this only copies
+        # when the skeleton does not use the shared data columns as they are (e.g. removed joints)
+        skeleton = self.skeletons[name]
+        motion = self.motions[skeleton]
+        channel_map = skeleton_plan(skeleton).channel_map
+        if np.array_equal(channel_map, np.arange(motion.data.shape[1])):
+            return motion
+        return Motion(motion.frames, motion.frame_time, motion.data[:, channel_map])
+
+    def resample(self, name, frame_time):
+        # converts the clip to another frame rate; skeletons sharing its data buffer (variations) follow along
+        skeleton = self.skeletons[name]
+        motion = self.motions[skeleton]
+        if motion.frame_time == frame_time:
+            return motion
+        sharing = [other_name for other_name, other in self.skeletons.items()
+                   if other in self.motions and self.motions[other].buffer is motion.buffer]
+        # rotations are interpolated per joint, so use a skeleton that reads every column (the source clip
+        # rather than a variation that removed joints)
+        columns = np.arange(motion.buffer.shape[1])
+        source = next((self.skeletons[other_name] for other_name in sharing
+                       if np.array_equal(np.sort(skeleton_plan(self.skeletons[other_name]).channel_map), columns)),
+                      skeleton)
+        resampled = resample_motion(source, motion, frame_time)
+        if self.storage is not None:
+            resampled = quantize_motion(resampled, self.storage)
+
+        indexed = [other_name for other_name in sharing
+                   if self.pose_index is not None and other_name in self.pose_index.clip_names]
+        for other_name in sharing:
+            other = self.skeletons[other_name]
+            self.motions[other] = shared_motion(resampled)
+            # the ground shift in the root offsets was measured on the old frames; the new buffer is shared,
+            # so it is never edited in place
+            correct_height(other, self.motions[other], in_place=False)
+        for other_name in indexed:
+            self.pose_index.remove_clip(other_name)
+            self.index_clip(other_name)
+        return self.motions[skeleton]
+
+    def export_bvh(self, output_dir, names=None, workers=None):
+        # writes <output_dir>/<name>.bvh for the given skeletons (default: all with motion, variations included)
+        if names is None:
+            names = [name for name, skeleton in self.skeletons.items() if skeleton in self.motions]
+        items = [(os.path.join(output_dir, f'{name}.bvh'), self.skeletons[name], self.get_motion(name))
+                 for name in names]
+        return write_bvh_batch(items, workers)
 
-        # Adjust height of the skeleton to the ground
-        min_y = float('inf')
-        for node in skeleton.traverse_pre_order():
-            min_y = min(min_y, node.get_rest_global_position()[1])
-        skeleton.offset = Vec3(skeleton.offset[0], skeleton.offset[1] - min_y, skeleton.offset[2])
-
-        if skeleton in self.motions:
-            motion = self.motions[skeleton]
-            # Adjust height of the motion to the ground
-            min_y_motion = float('inf')
-            for i in range(motion.frames):
-                for node in skeleton.traverse_pre_order():
-                    min_y_motion = min(min_y_motion, node.get_global_transform(motion.data[i]).get_cell(3, 1))
-
-            channel_index = 0
-            for channel in skeleton.channels:
-                if channel == 'Yposition':
-                    break
-                channel_index += 1
-
-            for i in range(motion.frames):
-                motion.data[i][channel_index] -= min_y_motion
-
-    def find_variation_name(self, name, recursion=0):
+    def find_variation_name(self, name):
         if name not in self.skeletons:
             return name
-        return self.find_variation_name(f'{name}_variation_{recursion}', recursion + 1)
+        # continue from the last used suffix so naming many variations stays linear
+        index = self.variation_counters.get(name, 0)
+        while f'{name}_variation_{index}' in self.skeletons:
+            index += 1
+        self.variation_counters[name] = index + 1
+        return f'{name}_variation_{index}'
 
     def traverse_skeleton_with_depth(self, skeleton, depth=0):
-        if 'augmented' not in skeleton.name.lower():
-            yield skeleton, depth
-        for child in skeleton.children:
-            if 'augmented' in child.name.lower():
-                yield from self.traverse_skeleton_with_depth(child, depth)
-            else:
-                yield from self.traverse_skeleton_with_depth(child, depth + 1)
+        return traverse_skeleton_with_depth(skeleton, depth)
+
+    def variation_params(self):
+        return {key: getattr(self, key) for key in VARIATION_PARAMS}
 
-    def add_variation(self, name, new_name=None):
+    def add_variation(self, name, new_name=None, seed=None):
         if new_name is None:
             new_name = self.find_variation_name(name)
 
-        new_skeleton = copy.deepcopy(self.skeletons[name])
-        random_seed = random.randint(0, 1000000)
-        for joint, depth in self.traverse_skeleton_with_depth(new_skeleton):
-            # to make the result symmetric
-            random.seed(random_seed + depth)
-            rand = random.random()
-            name = joint.name.lower()
-            # if joint is spine or neck, randomly add or remove joints
-            if 'spine' in name or 'neck' in name:
-                add_prob = self.spine_add_prob if 'spine' in name else self.neck_add_prob
-                remove_prob = self.spine_remove_prob if 'spine' in name else self.neck_remove_prob
-                if rand < add_prob:
-                    # add joint to center of children
-                    offset = sum([child.offset for child in joint.children], Vec3(0, 0, 0)) / len(joint.children)
-                    new_joint = Joint(name + '_augmented', joint.type, joint.parent, copy.copy(joint.children), [], offset)
-                    new_joint.channel_index = joint.channel_index
-                    joint.clear_children()
-                    joint.add_child(new_joint)
-                elif rand < add_prob + remove_prob:
-                    parent = joint.parent
-                    parent.remove_child(joint)
-                    children = copy.copy(joint.children)
-                    for child in children:
-                        parent.add_child(child)
-            # if joint is hip or shoulder, randomly add dummy joints (end-joints)
-            elif 'hip' in name or 'shoulder' in name:
-                add_prob = self.hip_add_prob if 'hip' in name else self.shoulder_add_prob
-                if rand < add_prob:
-                    new_joint = Joint(name + '_augmented', 'end', joint, [], [])
-                    # set offset as random value
-                    new_joint.offset = Vec3(random.gauss(0, 1), random.gauss(0, 1), random.gauss(0, 1))
-                    joint.add_child(new_joint)
-            # if joint is end type, randomly set offset to zero
-            elif joint.type == 'end':
-                if rand < self.end_zero_prob:
-                    joint.offset = Vec3(0, 0, 0)
-            # randomly scale offset
-            joint.offset = joint.offset * random.gauss(1, self.scale_sigma)
-
-        self.skeletons[new_name] = new_skeleton
-        self.correct_skeleton_height(new_name)
+        skeleton = self.skeletons[name]
+        motion = self.motions.get(skeleton)
+        new_skeleton = make_variation(skeleton, self.variation_params(), np.random.SeedSequence(seed), motion)
+        self.add_shared_skeleton(new_name, new_skeleton, motion)
         return new_name
+
+    def add_shared_skeleton(self, name, skeleton, motion):
+        # variations keep their source's channel_index values, so they can share its motion buffer as is
+        self.skeletons[name] = skeleton
+        if motion is not None:
+            self.motions[skeleton] = shared_motion(motion)
+
+    def add_variations(self, name, count, seed=None, workers=None) -> List[str]:
+        # every variation gets its own child SeedSequence, so the result only depends on (seed, index)
+        seed_sequences = np.random.SeedSequence(seed).spawn(count)
+        skeleton = self.skeletons[name]
+        motion = self.motions.get(skeleton)
+        params = self.variation_params()
+
+        if workers == 1 or count <= 1:
+            new_skeletons = make_variations(skeleton, params, seed_sequences, motion)
+        else:
+            workers = workers or os.cpu_count() or 1
+            chunk_size = max(1, -(-count // (workers * 4)))
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_variation_worker,
+                                     initargs=(motion,)) as executor:
+                futures = [executor.submit(make_variations, skeleton, params, seed_sequences[i:i + chunk_size])
+                           for i in range(0, count, chunk_size)]
+                new_skeletons = [new_skeleton for future in futures for new_skeleton in future.result()]
+
+        new_names = []
+        for new_skeleton in new_skeletons:
+            new_name = self.find_variation_name(name)
+            self.add_shared_skeleton(new_name, new_skeleton, motion)
+            new_names.append(new_name)
+        return new_names
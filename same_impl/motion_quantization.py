@@ -0,0 +1,116 @@
+import numpy as np
+
+from same_impl.motion_struct import Motion
+
+STORAGE_MODES = ('float32', 'int16', 'delta')
+
+# largest int16 code used, symmetric around the channel's midpoint
+INT16_CODES = 32767
+# largest int8 step between frames in delta mode
+INT8_STEP = 127
+
+
+class QuantizedMotion:
+    # Motion data stored compactly and decoded on access:
+    #   float32: data rounded to float32
+    #   int16:   per-channel data = codes * scale + offset
+    #   delta:   same mapping, but int32 codes only every keyframe_interval frames and int8 code steps in between;
+    #            the scale is chosen per channel so every frame-to-frame change fits, so slowly changing channels
+    #            get a finer resolution than int16 and decoding never drifts
+    # error_bound holds the largest absolute decoding error of each channel, measured when encoding.
+    __slots__ = ['frames', 'frame_time', 'mode', 'codes', 'keyframes', 'scale', 'offset', 'keyframe_interval',
+                 'error_bound']
+
+    def __init__(self, frames, frame_time, mode, codes, scale=None, offset=None, keyframes=None,
+                 keyframe_interval=0):
+        self.frames = frames
+        self.frame_time = frame_time
+        self.mode = mode
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.keyframes = keyframes
+        self.keyframe_interval = keyframe_interval
+        self.error_bound = None
+
+    @property
+    def buffer(self):
+        return self.codes
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.codes, self.scale, self.offset, self.keyframes) if array is not None)
+
+    @property
+    def max_error(self):
+        return float(self.error_bound.max()) if len(self.error_bound) else 0.0
+
+    @property
+    def data(self):
+        # the whole clip as float64, decoded in one vectorized pass
+        if self.mode == 'float32':
+            return self.codes.astype(np.float64)
+        if self.mode == 'int16':
+            return self.codes * self.scale + self.offset
+
+        interval = self.keyframe_interval
+        blocks = len(self.keyframes)
+        padded = np.zeros((blocks * interval, self.codes.shape[1]), dtype=np.int32)
+        padded[:self.frames] = self.codes
+        codes = np.cumsum(padded.reshape(blocks, interval, -1), axis=1) + self.keyframes[:, None]
+        return codes.reshape(blocks * interval, -1)[:self.frames] * self.scale + self.offset
+
+    def take(self, frames):
+        # decodes only the requested frames (e.g. the current ones during playback)
+        frames = np.asarray(frames, dtype=np.intp)
+        if self.mode == 'float32':
+            return self.codes[frames].astype(np.float64)
+        if self.mode == 'int16':
+            return self.codes[frames] * self.scale + self.offset
+
+        # a frame is its block's keyframe plus the steps since the block start (the keyframe row's step is 0)
+        interval = self.keyframe_interval
+        blocks = frames // interval
+        steps = np.arange(interval)
+        rows = np.minimum(blocks[..., None] * interval + steps, self.frames - 1)
+        mask = steps <= (frames % interval)[..., None]
+        codes = np.einsum('...sc,...s->...c', self.codes[rows].astype(np.int32), mask.astype(np.int32))
+        return (codes + self.keyframes[blocks]) * self.scale + self.offset
+
+    def frame(self, index):
+        return self.take(index)
+
+    def to_motion(self):
+        return Motion(self.frames, self.frame_time, self.data)
+
+
+def quantize_motion(motion: Motion, mode='int16', keyframe_interval=32) -> QuantizedMotion:
+    if mode not in STORAGE_MODES:
+        raise ValueError(f'Unknown storage mode {mode}, expected one of {STORAGE_MODES}')
+    data = np.asarray(motion.data, dtype=np.float64)
+
+    if mode == 'float32':
+        quantized = QuantizedMotion(motion.frames, motion.frame_time, mode, data.astype(np.float32))
+    else:
+        low, high = (data.min(axis=0), data.max(axis=0)) if len(data) else (np.zeros(data.shape[1]),) * 2
+        offset = (low + high) / 2
+        scale = (high - low) / (2 * INT16_CODES)
+        if mode == 'int16':
+            scale = np.where(scale > 0, scale, 1.0)
+            codes = np.round((data - offset) / scale).astype(np.int16)
+            quantized = QuantizedMotion(motion.frames, motion.frame_time, mode, codes, scale, offset)
+        else:
+            if len(data) > 1:
+                # the keyframes are int32, so only the largest change between frames limits the resolution;
+                # one code of slack, as rounding can make a step one code larger than the change itself
+                scale = np.abs(np.diff(data, axis=0)).max(axis=0) / (INT8_STEP - 1)
+            scale = np.where(scale > 0, scale, 1.0)
+            codes = np.round((data - offset) / scale).astype(np.int32)
+            keyframes = codes[::keyframe_interval].copy()
+            steps = np.diff(codes, axis=0, prepend=codes[:1])
+            steps[::keyframe_interval] = 0
+            quantized = QuantizedMotion(motion.frames, motion.frame_time, mode, steps.astype(np.int8), scale, offset,
+                                        keyframes, keyframe_interval)
+
+    quantized.error_bound = np.abs(quantized.data - data).max(axis=0) if len(data) else np.zeros(data.shape[1])
+    return quantized
@@ -1,14 +1,37 @@
-from panda3d.core import LMatrix4f, Vec3
+import hashlib
+
+import numpy as np
+
+
+# 4x4 matrices in the row-vector convention used by Panda3D's LMatrix4f (translation in the last row)
+def translate_mat(x, y, z):
+    transform = np.identity(4)
+    transform[3, :3] = x, y, z
+    return transform
+
+
+def rotate_mat(angle, axis):
+    radians = np.radians(angle)
+    cos, sin = np.cos(radians), np.sin(radians)
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    transform = np.identity(4)
+    transform[i, i] = cos
+    transform[i, j] = sin
+    transform[j, i] = -sin
+    transform[j, j] = cos
+    return transform
 
 
 class Joint:
     __slots__ = ['name', 'type', 'parent', 'children', 'channels', 'offset', 'channel_index']
 
-    def __init__(self, name, type, parent=None, children=None, channels=None, offset=Vec3(0, 0, 0)):
+    def __init__(self, name, type, parent=None, children=None, channels=None, offset=None):
         if channels is None:
             channels = []
         if children is None:
             children = []
+        if offset is None:
+            offset = np.zeros(3)
 
         self.name = name
         self.type = type
@@ -59,26 +82,26 @@ class Joint:
     def get_global_transform(self, motion):
         if self.parent is None:
             return self.get_local_transform(motion)
-        return self.get_local_transform(motion) * self.parent.get_global_transform(motion)
+        return self.get_local_transform(motion) @ self.parent.get_global_transform(motion)
 
     def get_local_transform(self, motion):
-        transform = LMatrix4f.ident_mat()
+        transform = np.identity(4)
 
-        transform = LMatrix4f.translate_mat(self.offset) * transform
+        transform = translate_mat(*self.offset) @ transform
         channel_index = self.channel_index
         for channel in self.channels:
             if channel == 'Xposition':
-                transform = LMatrix4f.translate_mat(motion[channel_index], 0, 0) * transform
+                transform = translate_mat(motion[channel_index], 0, 0) @ transform
             elif channel == 'Yposition':
-                transform = LMatrix4f.translate_mat(0, motion[channel_index], 0) * transform
+                transform = translate_mat(0, motion[channel_index], 0) @ transform
             elif channel == 'Zposition':
-                transform = LMatrix4f.translate_mat(0, 0, motion[channel_index]) * transform
+                transform = translate_mat(0, 0, motion[channel_index]) @ transform
             elif channel == 'Xrotation':
-                transform = LMatrix4f.rotate_mat(motion[channel_index], (1, 0, 0)) * transform
+                transform = rotate_mat(motion[channel_index], 0) @ transform
             elif channel == 'Yrotation':
-                transform = LMatrix4f.rotate_mat(motion[channel_index], (0, 1, 0)) * transform
+                transform = rotate_mat(motion[channel_index], 1) @ transform
             elif channel == 'Zrotation':
-                transform = LMatrix4f.rotate_mat(motion[channel_index], (0, 0, 1)) * transform
+                transform = rotate_mat(motion[channel_index], 2) @ transform
             channel_index += 1
 
         return transform
@@ -91,3 +114,112 @@ class Motion:
         self.frames = frames
         self.frame_time = frame_time
         self.data = data
+
+    @property
+    def buffer(self):
+        # the stored array; skeletons whose motions have the same buffer share their data
+        return self.data
+
+    def take(self, frames):
+        return self.data[frames]
+
+
+CHANNEL_NAMES = ('Xposition', 'Yposition', 'Zposition', 'Xrotation', 'Yrotation', 'Zrotation')
+MAX_CHANNELS = 6
+
+
+class SkeletonArrays:
+    # Immutable flat form of a Joint tree. Joints are stored in pre-order, so every parent comes before its
+    # children. Channel layouts are CHANNEL_NAMES codes padded with -1, and channel_offsets are the joints'
+    # channel_index into the motion data (-1 when unset).
+    __slots__ = ['names', 'types', 'parents', 'offsets', 'depths', 'channel_layout', 'channel_counts',
+                 'channel_offsets', 'topology_digest']
+
+    def __init__(self, names, types, parents, offsets, depths, channel_layout, channel_counts, channel_offsets):
+        self.names = tuple(names)
+        self.types = tuple(types)
+        self.parents = self.frozen(parents, np.intp)
+        self.offsets = self.frozen(offsets, np.float64).reshape(-1, 3)
+        self.depths = self.frozen(depths, np.intp)
+        self.channel_layout = self.frozen(channel_layout, np.int8).reshape(-1, MAX_CHANNELS)
+        self.channel_counts = self.frozen(channel_counts, np.intp)
+        self.channel_offsets = self.frozen(channel_offsets, np.intp)
+        self.topology_digest = None
+
+    @staticmethod
+    def frozen(array, dtype):
+        array = np.array(array, dtype=dtype)
+        array.setflags(write=False)
+        return array
+
+    @classmethod
+    def from_joint(cls, skeleton: Joint):
+        names, types, parents, offsets, depths, layout, counts, channel_offsets = [], [], [], [], [], [], [], []
+        stack = [(skeleton, -1, 0)]
+        while stack:
+            joint, parent, depth = stack.pop()
+            index = len(names)
+            names.append(joint.name)
+            types.append(joint.type)
+            parents.append(parent)
+            offsets.append((joint.offset[0], joint.offset[1], joint.offset[2]))
+            depths.append(depth)
+            codes = [CHANNEL_NAMES.index(channel) for channel in joint.channels]
+            layout.append(codes + [-1] * (MAX_CHANNELS - len(codes)))
+            counts.append(len(codes))
+            channel_offsets.append(-1 if joint.channel_index is None else joint.channel_index)
+            for child in reversed(joint.children):
+                stack.append((child, index, depth + 1))
+        return cls(names, types, parents, offsets, depths, layout, counts, channel_offsets)
+
+    def to_joint(self) -> Joint:
+        joints = []
+        for i in range(len(self)):
+            joint = Joint(self.names[i], self.types[i],
+                          channels=[CHANNEL_NAMES[code] for code in self.channel_layout[i, :self.channel_counts[i]]],
+                          offset=self.offsets[i].copy())
+            joint.channel_index = None if self.channel_offsets[i] < 0 else int(self.channel_offsets[i])
+            if self.parents[i] >= 0:
+                joints[self.parents[i]].add_child(joint)
+            joints.append(joint)
+        return joints[0]
+
+    def with_offsets(self, offsets):
+        arrays = SkeletonArrays(self.names, self.types, self.parents, offsets, self.depths, self.channel_layout,
+                                self.channel_counts, self.channel_offsets)
+        arrays.topology_digest = self.topology_digest
+        return arrays
+
+    @property
+    def topology_hash(self):
+        # everything but the offsets: joint names and types, structure, channel orders and data columns
+        if self.topology_digest is None:
+            digest = hashlib.sha1()
+            digest.update('\0'.join(self.names).encode('utf-8'))
+            digest.update('\0'.join(self.types).encode('utf-8'))
+            for array in (self.parents, self.channel_layout, self.channel_offsets):
+                digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+            self.topology_digest = digest.hexdigest()
+        return self.topology_digest
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def total_channels(self):
+        return int(self.channel_counts.sum())
+
+    def levels(self):
+        # joint indices grouped by depth; each group only depends on the previous ones
+        return [np.flatnonzero(self.depths == depth) for depth in range(int(self.depths.max(initial=0)) + 1)]
+
+    def rest_global_positions(self):
+        positions = self.offsets.copy()
+        for joint_indices in self.levels()[1:]:
+            positions[joint_indices] += positions[self.parents[joint_indices]]
+        return positions
+
+    def channel_map(self):
+        # motion data columns used by this skeleton, in pre-order channel layout
+        return np.concatenate([np.arange(start, start + count) for start, count in
+                               zip(self.channel_offsets, self.channel_counts) if count > 0] or [[]]).astype(np.intp)
@@ -15,7 +15,7 @@ class OrbitControl(DirectObject):
     distance = 10
 
     def __init__(self, mouse_watcher_node: panda3d.core.MouseWatcher, camera: panda3d.core.Camera,
-                 win: panda3d.core.WindowHandle):
+                 win: panda3d.core.WindowHandle, profiler=None):
         DirectObject.__init__(self)
 
         self.mouse_watcher_node = mouse_watcher_node
@@ -27,7 +27,10 @@ class OrbitControl(DirectObject):
         self.camera.set_pos(0, 0, self.distance)
         self.camera.look_at(self.camera_center)
 
-        self.add_task(self.spin_camera_task)
+        if profiler is not None:
+            self.add_task(profiler.wrap_task(self.spin_camera_task), 'spin_camera_task')
+        else:
+            self.add_task(self.spin_camera_task)
         self.accept('wheel_up', self.wheel_up)
         self.accept('wheel_down', self.wheel_down)
 
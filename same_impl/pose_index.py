@@ -0,0 +1,259 @@
+import json
+import os
+
+import numpy as np
+
+from same_impl.motion_struct import Joint, Motion, SkeletonArrays
+from same_impl.skeleton_plans import fk_program
+
+INDEX_VERSION = 1
+
+# relative error allowed for in projected distances
+BOUND_SLACK = 1e-4
+
+
+def feature_joint_names(arrays: SkeletonArrays):
+    # every named joint except the root; end sites are all called 'end', so they cannot be matched by name
+    return [name for name, joint_type in zip(arrays.names, arrays.types) if joint_type == 'joint']
+
+
+def root_relative_positions(arrays: SkeletonArrays, data, joint_indices, align_heading=True, chunk_size=8192):
+    # (frames, joints, 3) positions relative to the root, rotated so the root faces +z when align_heading is set;
+    # FK runs in chunks so long clips never hold all frames' rotation matrices at once
+    program = fk_program(arrays)
+    relative = np.empty((len(data), len(joint_indices), 3), dtype=np.float64)
+    for start in range(0, len(data), chunk_size):
+        rotations, positions = program.run(data[start:start + chunk_size])
+        chunk = positions[:, joint_indices] - positions[:, :1]
+        if align_heading:
+            # yaw of the root's local z axis around the vertical axis
+            forward = rotations[:, 0, :, 2]
+            yaw = np.arctan2(forward[:, 0], forward[:, 2])[:, None]
+            cos, sin = np.cos(yaw), np.sin(yaw)
+            x, z = chunk[..., 0].copy(), chunk[..., 2].copy()
+            chunk[..., 0] = cos * x - sin * z
+            chunk[..., 2] = sin * x + cos * z
+        relative[start:start + len(chunk)] = chunk
+    return relative
+
+
+def pose_features(skeleton, motion: Motion, joint_names, velocity_weight=0.1, align_heading=True):
+    # per-frame feature rows: root-relative joint positions followed by their velocities (units per second)
+    arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+    index = {name: i for i, name in enumerate(arrays.names)}
+    missing = [name for name in joint_names if name not in index]
+    if missing:
+        raise KeyError(f'Skeleton has no joints named {missing}')
+    joint_indices = np.array([index[name] for name in joint_names], dtype=np.intp)
+
+    relative = root_relative_positions(arrays, np.asarray(motion.data, dtype=np.float64), joint_indices,
+                                       align_heading)
+    if len(relative) > 1:
+        velocities = np.gradient(relative, motion.frame_time, axis=0)
+    else:
+        velocities = np.zeros_like(relative)
+    frames = len(relative)
+    return np.concatenate([relative.reshape(frames, -1), velocity_weight * velocities.reshape(frames, -1)],
+                          axis=1).astype(np.float32)
+
+
+class PoseIndex:
+    # Exact nearest-neighbour search over the frames of many clips. Rows are also projected onto their first
+    # principal components; a projected distance never exceeds the full one, so a query scans only the small
+    # projected rows and computes full distances for the few rows the projection cannot rule out.
+    def __init__(self, joint_names=None, velocity_weight=0.1, align_heading=True, projection_dimension=16,
+                 query_chunk=16):
+        self.joint_names = list(joint_names) if joint_names is not None else None
+        self.velocity_weight = velocity_weight
+        self.align_heading = align_heading
+        self.projection_dimension = projection_dimension
+        self.query_chunk = query_chunk
+
+        self.clip_names = []
+        self.clip_ranges = []
+        self.size = 0
+        self.features = np.zeros((0, 0), dtype=np.float32)
+        self.clip_ids = np.zeros(0, dtype=np.int32)
+        self.frames = np.zeros(0, dtype=np.int32)
+
+        # projection state, fitted lazily by the first query and refitted when the index has grown a lot
+        self.mean = None
+        self.basis = None
+        self.fitted_size = 0
+        self.projected = np.zeros((0, 0), dtype=np.float32)
+        self.projected_norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def dimension(self):
+        return 0 if self.joint_names is None else 6 * len(self.joint_names)
+
+    def accepts(self, skeleton: Joint):
+        if self.joint_names is None:
+            return True
+        names = set(joint.name for joint in skeleton.traverse_pre_order())
+        return all(name in names for name in self.joint_names)
+
+    def features_of(self, skeleton, motion: Motion):
+        if self.joint_names is None:
+            arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+            self.joint_names = feature_joint_names(arrays)
+        return pose_features(skeleton, motion, self.joint_names, self.velocity_weight, self.align_heading)
+
+    @staticmethod
+    def grow(array, rows, size):
+        # capacity doubles, so adding clips one at a time stays linear overall
+        if rows <= len(array):
+            return array
+        grown = np.zeros((max(rows, 2 * len(array), 1024),) + array.shape[1:], dtype=array.dtype)
+        grown[:size] = array[:size]
+        return grown
+
+    def add_clip(self, name, skeleton, motion: Motion):
+        if name in self.clip_names:
+            raise ValueError(f'Clip {name} is already indexed')
+        features = self.features_of(skeleton, motion)
+        start, stop = self.size, self.size + len(features)
+        if self.features.shape[1] != self.dimension:
+            self.features = np.zeros((0, self.dimension), dtype=np.float32)
+        self.features = self.grow(self.features, stop, start)
+        self.clip_ids = self.grow(self.clip_ids, stop, start)
+        self.frames = self.grow(self.frames, stop, start)
+        self.features[start:stop] = features
+        self.clip_ids[start:stop] = len(self.clip_names)
+        self.frames[start:stop] = np.arange(len(features))
+        if self.basis is not None:
+            self.project(start, stop)
+        self.clip_names.append(name)
+        self.clip_ranges.append((start, stop))
+        self.size = stop
+
+    def remove_clip(self, name):
+        # later rows move down to close the gap; loaded memory-mapped arrays are copied into memory first
+        position = self.clip_names.index(name)
+        start, stop = self.clip_ranges[position]
+        count, size = stop - start, self.size
+        for attribute in ('features', 'clip_ids', 'frames', 'projected', 'projected_norms'):
+            array = getattr(self, attribute)
+            if len(array) < size:
+                continue
+            if not array.flags.writeable:
+                array = np.array(array)
+                setattr(self, attribute, array)
+            array[start:size - count] = array[stop:size]
+        self.clip_ids[start:size - count] -= 1
+        del self.clip_names[position], self.clip_ranges[position]
+        self.clip_ranges[position:] = [(first - count, last - count) for first, last in self.clip_ranges[position:]]
+        self.size -= count
+
+    def fit(self, sample_size=50000):
+        rows = self.features[:self.size]
+        sample = rows[::max(1, self.size // sample_size)].astype(np.float64)
+        self.mean = sample.mean(axis=0)
+        centered = sample - self.mean
+        # eigenvectors of the covariance, largest eigenvalues first
+        _, vectors = np.linalg.eigh(centered.T @ centered)
+        self.basis = np.ascontiguousarray(vectors[:, ::-1][:, :self.projection_dimension], dtype=np.float32)
+        self.fitted_size = self.size
+        self.projected = np.zeros((0, self.basis.shape[1]), dtype=np.float32)
+        self.projected_norms = np.zeros(0, dtype=np.float32)
+        self.project(0, self.size)
+
+    def project(self, start, stop):
+        self.projected = self.grow(self.projected, stop, start)
+        self.projected_norms = self.grow(self.projected_norms, stop, start)
+        for chunk in range(start, stop, 1 << 16):
+            end = min(chunk + (1 << 16), stop)
+            projected = (self.features[chunk:end] - self.mean.astype(np.float32)) @ self.basis
+            self.projected[chunk:end] = projected
+            self.projected_norms[chunk:end] = np.einsum('ij,ij->i', projected, projected)
+
+    def query(self, features, k=1, exclude_clip=None):
+        # k nearest rows of each query row: (distances, clip indices, frames), each (queries, k), nearest first
+        queries = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        k = min(k, self.size)
+        if self.basis is None or self.size > 4 * self.fitted_size:
+            self.fit()
+        excluded = self.clip_ranges[self.clip_names.index(exclude_clip)] if exclude_clip is not None else None
+
+        distances = np.zeros((len(queries), k), dtype=np.float32)
+        rows = np.zeros((len(queries), k), dtype=np.intp)
+        for chunk in range(0, len(queries), self.query_chunk):
+            chunk_queries = queries[chunk:chunk + self.query_chunk]
+            projected = (chunk_queries - self.mean.astype(np.float32)) @ self.basis
+            # lower bounds shrunk slightly to cover float32 rounding in the expansion, so no true neighbour
+            # is ruled out
+            norms = np.einsum('ij,ij->i', projected, projected) * (1 - BOUND_SLACK) - 1e-6
+            coarse = self.projected[:self.size] @ (-2 * projected.T)
+            coarse += self.projected_norms[:self.size, None] * (1 - BOUND_SLACK)
+            coarse += norms
+            if excluded is not None:
+                coarse[excluded[0]:excluded[1]] = np.inf
+            for column, query in enumerate(chunk_queries):
+                distances[chunk + column], rows[chunk + column] = self.refine(query, coarse[:, column], k)
+
+        return np.sqrt(distances), self.clip_ids[rows], self.frames[rows]
+
+    def refine(self, query, coarse, k):
+        # full distances of the rows with the smallest lower bounds give a radius; every row whose lower bound
+        # is within that radius is a candidate, the others cannot be among the k nearest
+        seeds = min(len(coarse), max(8 * k, 64))
+        candidates = np.argpartition(coarse, seeds - 1)[:seeds]
+        exact = self.exact_distances(query, candidates)
+        exact[np.isinf(coarse[candidates])] = np.inf
+        radius = np.partition(exact, k - 1)[k - 1]
+        candidates = np.flatnonzero(coarse <= radius)
+        exact = self.exact_distances(query, candidates)
+        nearest = np.argpartition(exact, k - 1)[:k] if len(exact) > k else np.arange(len(exact))
+        nearest = nearest[np.argsort(exact[nearest], kind='stable')]
+        return exact[nearest], candidates[nearest]
+
+    def exact_distances(self, query, rows):
+        differences = self.features[rows] - query
+        return np.einsum('ij,ij->i', differences, differences)
+
+    def query_pose(self, skeleton, motion: Motion, k=1, exclude_clip=None):
+        return self.query(self.features_of(skeleton, motion), k, exclude_clip)
+
+    def find_duplicates(self, threshold, stride=10, min_fraction=0.9):
+        # pairs (clip, other clip, fraction) where most sampled frames of a clip have a neighbour in the other
+        # clip closer than threshold, e.g. the same take exported twice
+        duplicates = []
+        if len(self.clip_names) < 2:
+            return duplicates
+        for name, (start, stop) in zip(self.clip_names, self.clip_ranges):
+            distances, clip_ids, _ = self.query(self.features[start:stop:stride], 1, exclude_clip=name)
+            close = distances[:, 0] <= threshold
+            counts = np.bincount(clip_ids[close, 0], minlength=len(self.clip_names))
+            for other in np.flatnonzero(counts >= min_fraction * len(distances)):
+                duplicates.append((name, self.clip_names[other], float(counts[other] / len(distances))))
+        return duplicates
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ('features', 'clip_ids', 'frames'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name)[:self.size])
+        with open(os.path.join(path, 'index.json'), 'w') as file:
+            json.dump({'version': INDEX_VERSION, 'joint_names': self.joint_names,
+                       'velocity_weight': self.velocity_weight, 'align_heading': self.align_heading,
+                       'projection_dimension': self.projection_dimension,
+                       'clip_names': self.clip_names, 'clip_ranges': self.clip_ranges}, file)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        # the projection is refitted by the first query
+        with open(os.path.join(path, 'index.json')) as file:
+            header = json.load(file)
+        if header.get('version') != INDEX_VERSION:
+            raise ValueError(f'Unsupported pose index version {header.get("version")}')
+        index = cls(header['joint_names'], header['velocity_weight'], header['align_heading'],
+                    header['projection_dimension'])
+        index.features = np.load(os.path.join(path, 'features.npy'), mmap_mode=mmap_mode)
+        index.clip_ids = np.load(os.path.join(path, 'clip_ids.npy'), mmap_mode=mmap_mode)
+        index.frames = np.load(os.path.join(path, 'frames.npy'), mmap_mode=mmap_mode)
+        index.clip_names = header['clip_names']
+        index.clip_ranges = [tuple(clip_range) for clip_range in header['clip_ranges']]
+        index.size = len(index.features)
+        return index
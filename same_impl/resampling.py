@@ -0,0 +1,74 @@
+import numpy as np
+
+from same_impl.kinematics import axis_rotation, make_continuous, quaternion_to_rotation, rotation_to_euler, \
+    rotation_to_quaternion, slerp
+from same_impl.motion_struct import Motion, SkeletonArrays
+
+
+def sample_times(frames, frame_time, target_frame_time):
+    # fractional source frames of every target frame; the clip keeps its duration (up to one target frame)
+    duration = (frames - 1) * frame_time
+    count = int(np.floor(duration / target_frame_time + 1e-9)) + 1
+    source_frames = np.arange(count) * (target_frame_time / frame_time)
+    base = np.minimum(np.floor(source_frames).astype(np.intp), max(frames - 2, 0))
+    return base, source_frames - base
+
+
+def rotation_groups(arrays: SkeletonArrays):
+    # joints with three distinct rotation axes, grouped by rotation order: {axes: (joint indices, columns)}
+    groups = {}
+    for joint_index, (layout, count, offset) in enumerate(zip(arrays.channel_layout, arrays.channel_counts,
+                                                              arrays.channel_offsets)):
+        slots = [slot for slot in range(count) if layout[slot] >= 3]
+        axes = tuple(int(layout[slot]) - 3 for slot in slots)
+        if len(set(axes)) != 3 or len(axes) != 3:
+            continue
+        joints, columns = groups.setdefault(axes, ([], []))
+        joints.append(joint_index)
+        columns.append([offset + slot for slot in slots])
+    return {axes: (np.array(joints), np.array(columns, dtype=np.intp)) for axes, (joints, columns) in groups.items()}
+
+
+def closest_euler(angles, reference):
+    # picks the Euler solution (and 360 degree turn) nearest to the reference angles, so resampled
+    # channels stay continuous with the source clip instead of jumping between equivalent solutions
+    first, middle, last = np.moveaxis(angles, -1, 0)
+    candidates = np.stack([angles, np.stack([first + 180, 180 - middle, last + 180], axis=-1)])
+    candidates += 360 * np.round((reference - candidates) / 360)
+    error = np.abs(candidates - reference).sum(axis=-1)
+    return np.where((error[0] <= error[1])[..., None], candidates[0], candidates[1])
+
+
+def resample_motion(skeleton, motion: Motion, frame_time) -> Motion:
+    # converts a clip to another frame rate. Joints with three rotation channels are interpolated with
+    # quaternion slerp and converted back to their own channel order; every other column (positions,
+    # partial rotations, columns used only by other skeletons sharing the buffer) is interpolated linearly.
+    arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+    data = np.asarray(motion.data)
+    base, t = sample_times(motion.frames, motion.frame_time, frame_time)
+    following = np.minimum(base + 1, motion.frames - 1)
+
+    weights = t[:, None]
+    resampled = data[base] * (1 - weights) + data[following] * weights
+    nearest = np.where(t < 0.5, base, following)
+
+    for axes, (_, columns) in rotation_groups(arrays).items():
+        angles = data[:, columns]
+        matrices = axis_rotation(axes[0], angles[..., 0]) @ axis_rotation(axes[1], angles[..., 1]) @ \
+            axis_rotation(axes[2], angles[..., 2])
+        quaternions = make_continuous(rotation_to_quaternion(matrices))
+        blended = slerp(quaternions[base], quaternions[following], t[:, None])
+        euler = rotation_to_euler(quaternion_to_rotation(blended), axes)
+        resampled[:, columns] = closest_euler(euler, angles[nearest])
+
+    return Motion(len(resampled), frame_time, resampled.astype(data.dtype, copy=False))
+
+
+def motion_windows(motion: Motion, length, stride=1):
+    # read-only (windows, length, channels) view of fixed-length windows starting every `stride` frames;
+    # nothing is copied, so this also works on memory-mapped data
+    data = np.asarray(motion.data)
+    if length > len(data):
+        return np.empty((0, length, data.shape[1]), dtype=data.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(data, length, axis=0)[::stride]
+    return np.swapaxes(windows, 1, 2)
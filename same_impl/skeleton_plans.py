@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from same_impl.kinematics import FKProgram
+from same_impl.motion_struct import SkeletonArrays
+
+
+class SkeletonPlan:
+    # Everything derived from a skeleton's topology alone, shared by all skeletons with the same topology_hash
+    # (e.g. a clip and its variations that only rescaled offsets). Offsets are applied by the caller.
+    __slots__ = ['topology_hash', 'program', 'channel_map', 'levels', 'bone_joints']
+
+    def __init__(self, arrays: SkeletonArrays):
+        self.topology_hash = arrays.topology_hash
+        self.program = FKProgram(arrays)
+        self.channel_map = arrays.channel_map()
+        self.channel_map.setflags(write=False)
+        self.levels = arrays.levels()
+        # joints drawn as a bone from their parent (before dropping zero-length ones, which depends on offsets)
+        self.bone_joints = np.flatnonzero(arrays.parents >= 0)
+
+
+class PlanCache:
+    # thread safe, as variations can be built on a background thread while the viewer compiles plans
+    __slots__ = ['entries', 'max_entries', 'hits', 'misses', 'evictions', 'lock']
+
+    def __init__(self, max_entries=256):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, skeleton) -> SkeletonPlan:
+        arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+        key = arrays.topology_hash
+        with self.lock:
+            plan = self.entries.get(key)
+            if plan is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return plan
+            self.misses += 1
+            plan = SkeletonPlan(arrays)
+            self.entries[key] = plan
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return plan
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+plan_cache = PlanCache()
+
+
+def skeleton_plan(skeleton) -> SkeletonPlan:
+    return plan_cache.get(skeleton)
+
+
+def fk_program(skeleton) -> FKProgram:
+    # FK program for this skeleton, compiled once per topology
+    arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+    return plan_cache.get(arrays).program.with_offsets(arrays.offsets)
@@ -1,6 +1,22 @@
-from panda3d.core import Vec3, LRotation
+import numpy as np
+from panda3d.core import Vec3, LRotation, Quat
 
-from same_impl.motion_struct import Joint, Motion
+from same_impl.instancing import InstancedPrimitive, segment_transforms, sphere_transforms
+from same_impl.kinematics import make_continuous, nlerp, rotation_to_quaternion, slerp
+from same_impl.motion_struct import Joint, Motion, SkeletonArrays
+from same_impl.skeleton_plans import fk_program, skeleton_plan
+
+AXES = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
+# primitives are loaded once per loader and shared between all joints through instance_to
+shared_models = {}
+
+
+def load_shared_model(loader, model_path):
+    key = (id(loader), model_path)
+    if key not in shared_models:
+        shared_models[key] = loader.load_model(model_path)
+    return shared_models[key]
 
 
 class SkeletonVisualizer:
@@ -11,89 +27,144 @@ class SkeletonVisualizer:
         self.connection_radius = connection_radius
         self.color = color
         self.skeleton = skeleton
+        self.arrays = SkeletonArrays.from_joint(skeleton)
 
         self.nodes = {}
-        self.skeleton_np = self.create_joint(skeleton, self.render)
+        # joint nodes in pre-order, matching self.arrays
+        self.joint_nodes = []
+        self.skeleton_np = self.create_nodes()
         self.skeleton_np.reparent_to(self.render)
         self.skeleton_np.set_color_scale(self.color)
 
-    def create_joint(self, joint, parent):
-        name = joint.name
-        offset = joint.offset
-
-        joint_np = parent.attach_new_node(name)
-        joint_np.set_pos(parent, offset)
-        self.nodes[name] = joint_np
-
-        joint_sphere = self.loader.load_model('models/sphere.glb')
-        joint_sphere.set_scale(self.joint_radius)
-        joint_sphere.reparent_to(joint_np)
-
-        for child in joint.children:
-            child_np = self.create_joint(child, joint_np)
-
-            # Draw connection
-            offset = child_np.get_pos(joint_np)
+        # pose cache filled by set_motion: per-frame local quaternions (w, x, y, z) and positions per joint
+        self.motion = None
+        self.pose_quats = None
+        self.pose_positions = None
+
+    def create_nodes(self):
+        # node layout from the cached plan: joints in pre-order, so every parent node exists before its children
+        arrays = self.arrays
+        sphere = load_shared_model(self.loader, 'models/sphere.glb')
+        for name, parent, offset in zip(arrays.names, arrays.parents, arrays.offsets):
+            parent_np = self.joint_nodes[parent] if parent >= 0 else self.render
+            joint_np = parent_np.attach_new_node(name)
+            joint_np.set_pos(Vec3(*offset))
+            self.nodes[name] = joint_np
+            self.joint_nodes.append(joint_np)
+
+            joint_sphere = joint_np.attach_new_node('sphere')
+            joint_sphere.set_scale(self.joint_radius)
+            sphere.instance_to(joint_sphere)
+
+        # Draw connections, skipping zero-length bones
+        cylinder = load_shared_model(self.loader, 'models/cylinder.glb')
+        for child in skeleton_plan(arrays).bone_joints:
+            offset = Vec3(*arrays.offsets[child])
             distance = offset.length()
             if distance < 1e-6:
                 continue
-            joint_cylinder = self.loader.load_model('models/cylinder.glb')
-            joint_cylinder.reparent_to(joint_np)
+            joint_cylinder = self.joint_nodes[arrays.parents[child]].attach_new_node('cylinder')
+            cylinder.instance_to(joint_cylinder)
             joint_cylinder.set_scale(self.connection_radius, self.connection_radius, distance / 2)
             joint_cylinder.set_pos(offset / 2)
             joint_cylinder.look_at(offset)
             joint_cylinder.set_p(joint_cylinder.get_p() + 90)
 
-        return joint_np
+        return self.joint_nodes[0]
 
     def update_joint(self, motion_data):
-        self.update_joint_recursive(self.skeleton, motion_data)
-
-    def update_joint_recursive(self, joint, motion_data, index=0):
-        name = joint.name
-        offset = joint.offset
-        channels = joint.channels
-        joint_np = self.nodes[name]
-
-        pos = Vec3(0, 0, 0)
-        quat = LRotation()
-        for channel in channels:
-            if channel == 'Xposition':
-                pos.x = motion_data[index]
-                index += 1
-            elif channel == 'Yposition':
-                pos.y = motion_data[index]
-                index += 1
-            elif channel == 'Zposition':
-                pos.z = motion_data[index]
-                index += 1
-            elif channel == 'Xrotation':
-                quat = LRotation((1, 0, 0), motion_data[index]) * quat
-                index += 1
-            elif channel == 'Yrotation':
-                quat = LRotation((0, 1, 0), motion_data[index]) * quat
-                index += 1
-            elif channel == 'Zrotation':
-                quat = LRotation((0, 0, 1), motion_data[index]) * quat
+        arrays = self.arrays
+        for joint_np, offset, layout, count, index in zip(self.joint_nodes, arrays.offsets, arrays.channel_layout,
+                                                          arrays.channel_counts, arrays.channel_offsets):
+            pos = Vec3(*offset)
+            quat = LRotation()
+            for channel in layout[:count]:
+                if channel < 3:
+                    pos[channel] += motion_data[index]
+                else:
+                    quat = LRotation(AXES[channel - 3], motion_data[index]) * quat
                 index += 1
 
-        joint_np.set_quat(quat)
-        joint_np.set_pos(pos + Vec3(*offset))
-
-        for child in joint.children:
-            index = self.update_joint_recursive(child, motion_data, index)
-
-        return index
+            joint_np.set_quat(quat)
+            joint_np.set_pos(pos)
+
+    def set_motion(self, motion: Motion):
+        rotations, translations = fk_program(self.arrays).local_transforms(motion.data)
+        self.motion = motion
+        self.pose_quats = make_continuous(rotation_to_quaternion(rotations))
+        self.pose_positions = translations
+
+    def update_pose(self, frame, interpolation='slerp'):
+        # frame may be fractional; playback loops, so the last frame blends into the first
+        frames = len(self.pose_quats)
+        base = int(np.floor(frame))
+        t = frame - base
+        index = base % frames
+        if interpolation is None or t == 0:
+            quats = self.pose_quats[index]
+            positions = self.pose_positions[index]
+        else:
+            next_index = (index + 1) % frames
+            blend = slerp if interpolation == 'slerp' else nlerp
+            quats = blend(self.pose_quats[index], self.pose_quats[next_index], t)
+            positions = self.pose_positions[index] * (1 - t) + self.pose_positions[next_index] * t
+
+        for joint_np, quat, pos in zip(self.joint_nodes, quats.tolist(), positions.tolist()):
+            joint_np.set_pos_quat(Vec3(*pos), Quat(*quat))
+
+    def update_time(self, seconds, interpolation='slerp'):
+        self.update_pose(seconds / self.motion.frame_time, interpolation)
 
     def clear_joint_transform(self):
-        self.clear_joint_transform_recursive(self.skeleton)
+        for joint_np, offset in zip(self.joint_nodes, self.arrays.offsets):
+            joint_np.set_pos(Vec3(*offset))
+            joint_np.set_quat(LRotation.ident_quat())
 
-    def clear_joint_transform_recursive(self, joint):
-        name = joint.name
-        offset = joint.offset
-        joint_np = self.nodes[name]
-        joint_np.set_pos(offset)
-        joint_np.set_quat(LRotation.ident_quat())
 
-        for child in joint.children:
-            self.clear_joint_transform_recursive(child)
+class InstancedSkeletonRenderer:
+    # Draws any number of skeletons with two instanced draw calls (joint spheres and bone cylinders).
+    # Joint positions come from numpy (e.g. forward kinematics) instead of per-joint scene graph nodes.
+    def __init__(self, render, loader, joint_radius=0.4, connection_radius=0.2):
+        self.joint_radius = joint_radius
+        self.connection_radius = connection_radius
+        self.root = render.attach_new_node('instanced_skeletons')
+        self.spheres = InstancedPrimitive(self.root, loader, 'models/sphere.glb')
+        self.cylinders = InstancedPrimitive(self.root, loader, 'models/cylinder.glb')
+
+        self.skeletons = []
+        self.placements = []
+        self.joint_starts = [0]
+        self.joint_colors = np.zeros((0, 4))
+        self.bone_parents = np.zeros(0, dtype=np.intp)
+        self.bone_children = np.zeros(0, dtype=np.intp)
+
+    def add_skeleton(self, skeleton, color=(1, 0, 0, 1), position=(0, 0, 0)):
+        arrays = skeleton if isinstance(skeleton, SkeletonArrays) else SkeletonArrays.from_joint(skeleton)
+        start = self.joint_starts[-1]
+        # like SkeletonVisualizer, bones with a zero rest offset are not drawn
+        children = skeleton_plan(arrays).bone_joints
+        children = children[np.linalg.norm(arrays.offsets[children], axis=-1) >= 1e-6]
+        self.bone_parents = np.concatenate([self.bone_parents, arrays.parents[children] + start])
+        self.bone_children = np.concatenate([self.bone_children, children + start])
+        self.joint_colors = np.concatenate([self.joint_colors, np.tile(color, (len(arrays), 1))])
+        self.skeletons.append(arrays)
+        self.placements.append(np.asarray(position, dtype=np.float64))
+        self.joint_starts.append(start + len(arrays))
+        return len(self.skeletons) - 1
+
+    def rest_positions(self):
+        return [arrays.rest_global_positions() for arrays in self.skeletons]
+
+    def update(self, joint_positions=None):
+        # joint_positions: one (joints x 3) array per skeleton in skeleton space, rest pose by default
+        if joint_positions is None:
+            joint_positions = self.rest_positions()
+        positions = np.concatenate([positions + placement for positions, placement in
+                                    zip(joint_positions, self.placements)] or [np.zeros((0, 3))])
+        self.update_flat(positions)
+
+    def update_flat(self, positions):
+        # positions: (total joints x 3) in render space, skeletons concatenated in insertion order
+        self.spheres.set_instances(sphere_transforms(positions, self.joint_radius), self.joint_colors)
+        self.cylinders.set_instances(segment_transforms(positions[self.bone_parents], positions[self.bone_children],
+                                                        self.connection_radius), self.joint_colors[self.bone_children])
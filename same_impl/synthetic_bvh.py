@@ -0,0 +1,64 @@
+import numpy as np
+
+AXIS_CHANNELS = {'X': 'Xrotation', 'Y': 'Yrotation', 'Z': 'Zrotation'}
+
+
+def chain_names(chain, length):
+    # the first chains get names the augmentation in MotionDatabase reacts to
+    if chain == 0:
+        return [f'Spine{i}' if i < length - 2 else ('Neck' if i == length - 2 else 'Head') for i in range(length)]
+    prefixes = ['LeftHip', 'RightHip', 'LeftShoulder', 'RightShoulder']
+    prefix = prefixes[chain - 1] if chain <= len(prefixes) else f'Extra{chain}_'
+    return [f'{prefix}{i}' for i in range(length)]
+
+
+def generate_bvh(path, joints=31, depth=6, frames=1000, channel_orders=('ZXY',), frame_time=1 / 30, seed=0):
+    # writes a random but well-formed BVH file: a root with chains of at most `depth` joints, each ending in an
+    # End Site. Rotation channel orders cycle through `channel_orders`, the root also gets position channels.
+    rng = np.random.default_rng(seed)
+    remaining = max(joints - 1, 0)
+    chain_lengths = []
+    while remaining > 0:
+        chain_lengths.append(min(depth, remaining))
+        remaining -= chain_lengths[-1]
+
+    lines = ['HIERARCHY']
+    channel_count = 6
+    joint_index = 0
+
+    def offset_line(indent, offset):
+        return f'{indent}OFFSET {offset[0]:.6f} {offset[1]:.6f} {offset[2]:.6f}'
+
+    def rotation_channels():
+        order = channel_orders[joint_index % len(channel_orders)]
+        return ' '.join(AXIS_CHANNELS[axis] for axis in order)
+
+    lines += ['ROOT Hips', '{', offset_line('\t', (0, 90, 0)),
+              f'\tCHANNELS 6 Xposition Yposition Zposition {rotation_channels()}']
+    for chain, length in enumerate(chain_lengths):
+        indent = '\t'
+        for name in chain_names(chain, length):
+            joint_index += 1
+            lines += [f'{indent}JOINT {name}', f'{indent}{{', offset_line(indent + '\t', rng.normal(0, 10, 3)),
+                      f'{indent}\tCHANNELS 3 {rotation_channels()}']
+            channel_count += 3
+            indent += '\t'
+        lines += [f'{indent}End Site', f'{indent}{{', offset_line(indent + '\t', rng.normal(0, 5, 3)), f'{indent}}}']
+        for _ in range(length):
+            indent = indent[:-1]
+            lines.append(f'{indent}}}')
+    lines.append('}')
+
+    # smooth periodic motion so the clip looks like movement rather than noise
+    time = np.arange(frames)[:, None] * frame_time
+    phases = rng.uniform(0, 2 * np.pi, channel_count)
+    amplitudes = rng.uniform(5, 45, channel_count)
+    data = amplitudes * np.sin(2 * np.pi * 0.5 * time + phases)
+    data[:, :3] = rng.normal(0, 5, 3) + np.concatenate([time * 100, np.zeros((frames, 1)), time * 20], axis=1)
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines))
+        file.write(f'\nMOTION\nFrames: {frames}\nFrame Time: {frame_time:.8f}\n')
+        np.savetxt(file, data, fmt='%.6f')
+
+    return path
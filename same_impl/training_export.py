@@ -0,0 +1,208 @@
+import copy
+import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from same_impl.kinematics import rotation_to_quaternion
+from same_impl.motion_database import MotionDatabase, make_variation
+from same_impl.motion_struct import SkeletonArrays
+from same_impl.skeleton_plans import fk_program
+
+# per-joint static features: offset (3), rest global position (3), depth (1), end site flag (1)
+JOINT_FEATURES = 8
+
+SHARD_FIELDS = {
+    'joint_features': np.float32,  # (samples, joints, JOINT_FEATURES)
+    'parents': np.int32,  # (samples, joints), -1 for the root and padding
+    'joint_mask': np.bool_,  # (samples, joints)
+    'local_rotations': np.float32,  # (samples, frames, joints, 4) quaternions (w, x, y, z)
+    'local_positions': np.float32,  # (samples, frames, joints, 3) translations relative to the parent
+    'global_rotations': np.float32,  # (samples, frames, joints, 4)
+    'global_positions': np.float32,  # (samples, frames, joints, 3)
+    'frame_mask': np.bool_,  # (samples, frames)
+    'clip_index': np.int32,  # (samples,) index into the shard's clip names
+    'start_frame': np.int32,  # (samples,)
+}
+
+
+class ExportConfig:
+    # variations: size of each clip's pool of skeleton variations per shard; samples draw from the pool, so
+    # grounding a variation over the whole clip is paid once per shard instead of once per sample
+    __slots__ = ['shard_size', 'window', 'max_joints', 'seed', 'augment', 'params', 'variations']
+
+    def __init__(self, shard_size=256, window=64, max_joints=128, seed=0, augment=True, params=None, variations=16):
+        self.shard_size = shard_size
+        self.window = window
+        self.max_joints = max_joints
+        self.seed = seed
+        self.augment = augment
+        self.params = params
+        self.variations = variations
+
+
+def shard_name(shard_index):
+    return f'shard_{shard_index:06d}'
+
+
+def sample_seeds(seed, shard_index, sample_index):
+    # independent streams for the clip choice, the window start and the skeleton variation
+    return np.random.SeedSequence(seed, spawn_key=(shard_index, sample_index)).spawn(3)
+
+
+def pool_seed(seed, shard_index, clip_index, variation_index):
+    # keys of length 4 never collide with those of sample_seeds and their children
+    return np.random.SeedSequence(seed, spawn_key=(shard_index, clip_index, variation_index, 0))
+
+
+def build_sample(skeleton, motion, config: ExportConfig, window_seed, arrays_out, index):
+    rng = np.random.default_rng(window_seed)
+    arrays = SkeletonArrays.from_joint(skeleton)
+    joints = len(arrays)
+    if joints > config.max_joints:
+        raise ValueError(f'Skeleton has {joints} joints, more than max_joints={config.max_joints}')
+
+    start = int(rng.integers(0, max(motion.frames - config.window, 0) + 1))
+    # take only decodes the window of quantized motions
+    data = np.asarray(motion.take(np.arange(start, min(start + config.window, motion.frames))), dtype=np.float64)
+    frames = len(data)
+
+    program = fk_program(arrays)
+    local_rotations, local_positions = program.local_transforms(data)
+    global_rotations, global_positions = program.run(data)
+
+    features = arrays_out['joint_features'][index]
+    features[:joints, 0:3] = arrays.offsets
+    features[:joints, 3:6] = arrays.rest_global_positions()
+    features[:joints, 6] = arrays.depths
+    features[:joints, 7] = [joint_type == 'end' for joint_type in arrays.types]
+    arrays_out['parents'][index, :joints] = arrays.parents
+    arrays_out['joint_mask'][index, :joints] = True
+    arrays_out['local_rotations'][index, :frames, :joints] = rotation_to_quaternion(local_rotations)
+    arrays_out['local_positions'][index, :frames, :joints] = local_positions
+    arrays_out['global_rotations'][index, :frames, :joints] = rotation_to_quaternion(global_rotations)
+    arrays_out['global_positions'][index, :frames, :joints] = global_positions
+    arrays_out['frame_mask'][index, :frames] = True
+    arrays_out['start_frame'][index] = start
+
+
+def allocate_shard(config: ExportConfig):
+    samples, frames, joints = config.shard_size, config.window, config.max_joints
+    shapes = {
+        'joint_features': (samples, joints, JOINT_FEATURES),
+        'parents': (samples, joints),
+        'joint_mask': (samples, joints),
+        'local_rotations': (samples, frames, joints, 4),
+        'local_positions': (samples, frames, joints, 3),
+        'global_rotations': (samples, frames, joints, 4),
+        'global_positions': (samples, frames, joints, 3),
+        'frame_mask': (samples, frames),
+        'clip_index': (samples,),
+        'start_frame': (samples,),
+    }
+    arrays = {name: np.zeros(shapes[name], dtype=dtype) for name, dtype in SHARD_FIELDS.items()}
+    arrays['parents'][:] = -1
+    # identity quaternions keep padded entries valid rotations
+    arrays['local_rotations'][..., 0] = 1
+    arrays['global_rotations'][..., 0] = 1
+    return arrays
+
+
+def write_shard(output_dir, shard_index, clip_names, clips, config: ExportConfig):
+    # everything in a shard depends only on (seed, shard index), so shards can be built in any order
+    final_path = os.path.join(output_dir, shard_name(shard_index))
+    if os.path.exists(final_path):
+        return final_path
+
+    arrays = allocate_shard(config)
+    # (clip index, pool index) -> variation, built when first drawn
+    variations = {}
+    for sample_index in range(config.shard_size):
+        clip_seed, window_seed, variation_seed = sample_seeds(config.seed, shard_index, sample_index)
+        clip_index = int(np.random.default_rng(clip_seed).integers(len(clips)))
+        arrays['clip_index'][sample_index] = clip_index
+        skeleton, motion = clips[clip_index]
+        if config.augment:
+            key = (clip_index, int(np.random.default_rng(variation_seed).integers(config.variations)))
+            if key not in variations:
+                # grounded over the whole clip like the clip itself, so heights mean the same with and
+                # without augmentation
+                variations[key] = make_variation(skeleton, config.params, pool_seed(config.seed, shard_index, *key),
+                                                 motion)
+            skeleton = variations[key]
+        build_sample(skeleton, motion, config, window_seed, arrays, sample_index)
+
+    # write into a temporary directory and rename it, so an interrupted export never leaves a partial shard
+    temp_path = f'{final_path}.{os.getpid()}.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_path, f'{name}.npy'), array)
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as file:
+        json.dump({'shard_index': shard_index, 'clip_names': clip_names, 'seed': config.seed,
+                   'shard_size': config.shard_size, 'window': config.window, 'max_joints': config.max_joints,
+                   'augment': config.augment, 'variations': config.variations}, file)
+    os.replace(temp_path, final_path)
+    return final_path
+
+
+# clips shared by all shards written in a worker process, sent once through the pool initializer
+worker_clips = None
+
+
+def init_export_worker(clip_names, clips, config):
+    global worker_clips
+    worker_clips = (clip_names, clips, config)
+
+
+def write_shard_worker(output_dir, shard_index):
+    clip_names, clips, config = worker_clips
+    return write_shard(output_dir, shard_index, clip_names, clips, config)
+
+
+def export_shards(database: MotionDatabase, output_dir, num_shards, config: ExportConfig = None, workers=None,
+                  max_pending=None, names=None):
+    # writes shard_000000 ... directories of .npy arrays; existing shards are skipped, so an interrupted
+    # export resumes where it stopped and produces the same files
+    # a copy, so the database's variation parameters are not written into the caller's config
+    config = copy.copy(config) if config is not None else ExportConfig()
+    if config.params is None:
+        config.params = database.variation_params()
+    if names is None:
+        names = sorted(name for name, skeleton in database.skeletons.items() if skeleton in database.motions)
+    clip_names = list(names)
+    clips = [(database.get_skeleton(name), database.get_motion(name)) for name in clip_names]
+    os.makedirs(output_dir, exist_ok=True)
+
+    pending_shards = [index for index in range(num_shards)
+                      if not os.path.exists(os.path.join(output_dir, shard_name(index)))]
+    if workers == 1:
+        for shard_index in pending_shards:
+            write_shard(output_dir, shard_index, clip_names, clips, config)
+    else:
+        workers = workers or os.cpu_count() or 1
+        max_pending = max_pending or 2 * workers
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_export_worker,
+                                 initargs=(clip_names, clips, config)) as executor:
+            # keep at most max_pending shards in flight so memory stays bounded
+            queue = iter(pending_shards)
+            running = set()
+            for shard_index in queue:
+                running.add(executor.submit(write_shard_worker, output_dir, shard_index))
+                if len(running) >= max_pending:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            for future in running:
+                future.result()
+
+    return [os.path.join(output_dir, shard_name(index)) for index in range(num_shards)]
+
+
+def load_shard(path, mmap_mode='r'):
+    shard = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in SHARD_FIELDS}
+    with open(os.path.join(path, 'meta.json')) as file:
+        shard['meta'] = json.load(file)
+    return shard